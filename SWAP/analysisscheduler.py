@@ -0,0 +1,207 @@
+"""
+Schedule the analysis of files on a number of worker threads.
+
+Each job has its own cancellation token, so cancelling one job doesn't affect any other,
+and a priority.  The foreground file, the one that has just been opened, always comes
+first, then the files being analysed ahead of time and last any re-analysis.  If all of
+the workers are busy when a more urgent job is submitted, the least urgent running job
+is stopped and queued again to make way for it.
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class AnalysisJob:
+    FOREGROUND = 0
+    PREFETCH = 1
+    REANALYSIS = 2
+
+    def __init__(self, file_name, profile, priority, sequence, tag=None):
+        self.file_name = file_name
+        self.profile = profile
+        self.priority = priority
+        self.sequence = sequence
+
+        #
+        # Identifies the request the job was submitted for, to whoever is given its results
+        #
+        self.tag = tag
+
+        #
+        # The cancellation token, passed to the analysis which checks it with is_set()
+        #
+        self.cancelled = threading.Event()
+        self.preempted = False
+
+        #
+        # Set when the job has finished running, whether it completed, was cancelled or failed
+        #
+        self.finished = threading.Event()
+        self.error = None
+
+        self.submitted_time = time.monotonic()
+        self.start_time = None
+        self.end_time = None
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def key(self):
+        return self.file_name, self.profile.name
+
+    #
+    # Seconds spent waiting in the queue and running, None if not reached yet
+    #
+    def wait_time(self):
+        return None if self.start_time is None else self.start_time - self.submitted_time
+
+    def run_time(self):
+        return None if self.start_time is None or self.end_time is None else self.end_time - self.start_time
+
+
+class AnalysisScheduler:
+    HISTORY = 100
+
+    #
+    # run_job(job) is called on a worker thread for each job, it should stop early once
+    # job.cancelled is set.  A job that raises is logged and the worker goes on to the next.
+    #
+    def __init__(self, run_job, workers=1, name="AnalysisScheduler"):
+        self.run_job = run_job
+        self.workers = workers
+
+        self._condition = threading.Condition()
+        self._queue = []
+        self._running = []
+        self._sequence = itertools.count()
+        self.completed = collections.deque(maxlen=AnalysisScheduler.HISTORY)
+
+        for i in range(workers):
+            threading.Thread(target=self._run_worker, daemon=True, name="{}-{}".format(name, i)).start()
+
+    #
+    # Queue a job, replacing any job for the same file and profile that is waiting or running
+    #
+    def submit(self, file_name, profile, priority=AnalysisJob.FOREGROUND, tag=None):
+        with self._condition:
+            job = AnalysisJob(file_name, profile, priority, next(self._sequence), tag)
+            self._cancel_where(lambda j: j.key() == job.key())
+            heapq.heappush(self._queue, job)
+
+            #
+            # Make way for the job if all of the workers are busy with less urgent ones
+            #
+            if len(self._running) >= self.workers:
+                least_urgent = max(self._running, key=lambda j: (j.priority, j.sequence))
+                if least_urgent.priority > priority:
+                    least_urgent.preempted = True
+                    least_urgent.cancel()
+
+            self._condition.notify()
+            return job
+
+    #
+    # Cancel the waiting and running jobs of a priority, or all of them, apart from those for
+    # the files in keep
+    #
+    def cancel(self, priority=None, keep=()):
+        with self._condition:
+            self._cancel_where(lambda j: (priority is None or j.priority == priority) and j.file_name not in keep)
+
+    #
+    # Whether there is a job for the file and profile waiting or running
+    #
+    def is_scheduled(self, file_name, profile):
+        with self._condition:
+            return any(j.key() == (file_name, profile.name) and not j.cancelled.is_set()
+                       for j in self._queue + self._running)
+
+    def _cancel_where(self, predicate):
+        for job in self._running:
+            if predicate(job):
+                job.preempted = False
+                job.cancel()
+        remaining = [j for j in self._queue if not predicate(j)]
+        for job in self._queue:
+            if predicate(job):
+                job.cancel()
+        if len(remaining) != len(self._queue):
+            self._queue = remaining
+            heapq.heapify(self._queue)
+
+    #
+    # The number of jobs waiting for a worker, in total or of a priority
+    #
+    def queue_depth(self, priority=None):
+        with self._condition:
+            return sum(1 for j in self._queue if priority is None or j.priority == priority)
+
+    def running(self):
+        with self._condition:
+            return list(self._running)
+
+    #
+    # The file name, profile name, priority, seconds waiting, seconds running and whether
+    # it was cancelled of the recently finished jobs
+    #
+    def timings(self):
+        with self._condition:
+            return [(j.file_name, j.profile.name, j.priority, j.wait_time(), j.run_time(), j.cancelled.is_set())
+                    for j in self.completed]
+
+    def _run_worker(self):
+        while True:
+            with self._condition:
+                while len(self._queue) == 0:
+                    self._condition.wait()
+                job = heapq.heappop(self._queue)
+                job.start_time = time.monotonic()
+                self._running.append(job)
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                job.error = e
+                print("Analysis of {} failed".format(job.file_name))
+                traceback.print_exc()
+
+            with self._condition:
+                job.end_time = time.monotonic()
+                self._running.remove(job)
+                self.completed.append(job)
+                #
+                # Start a preempted job again later, unless it has been replaced since or failed
+                #
+                if job.preempted and job.error is None and \
+                        not any(j.key() == job.key() for j in self._queue + self._running):
+                    heapq.heappush(self._queue,
+                                   AnalysisJob(job.file_name, job.profile, job.priority, job.sequence, job.tag))
+                    self._condition.notify()
+            job.finished.set()
+
+
+if __name__ == "__main__":
+
+    class Profile:
+        name = "standard"
+
+    def run(job):
+        job.cancelled.wait(0.2)
+        print("{} {} priority {}".format("Cancelled" if job.cancelled.is_set() else "Finished",
+                                         job.file_name, job.priority))
+
+    scheduler = AnalysisScheduler(run, workers=1)
+    scheduler.submit("next.mp3", Profile(), AnalysisJob.PREFETCH)
+    time.sleep(0.05)
+    scheduler.submit("current.mp3", Profile(), AnalysisJob.FOREGROUND)
+    time.sleep(1)
+    for t in scheduler.timings():
+        print(t)
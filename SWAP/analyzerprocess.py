@@ -0,0 +1,149 @@
+"""
+Run the segments analysis in a separate process so that it doesn't compete with the player
+thread for the GIL.
+
+The worker process has its own SegmentsAnalyzer.  Files to process are sent to it over a
+pipe, and its progress, segments and completion are sent back and passed on to the
+callbacks of the SegmentsAnalyzer in this process by a relay thread.  Each file sent to be
+processed is numbered, and the worker's messages carry the number of the file they are
+about, so that those still on their way for a file that has since been replaced are dropped.
+"""
+
+import atexit
+import multiprocessing
+import threading
+import traceback
+
+
+class AnalyzerProcess:
+
+    #
+    # The settings of the SegmentsAnalyzer that are copied to the worker with each file
+    #
+    SETTINGS = ["reduced_decode", "quick_analysis", "incremental", "refine_boundaries", "workers"]
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+        #
+        # The worker isn't a daemon process as it may start its own pool of workers, so make
+        # sure it is stopped when this process exits
+        #
+        context = multiprocessing.get_context("spawn")
+        self._conn, worker_conn = context.Pipe()
+        self._send_lock = threading.Lock()
+        self._generation = 0
+        self._process = context.Process(
+                target=_run_worker,
+                args=(worker_conn,),
+                name="SegmentsAnalyzerProcess")
+        self._process.start()
+        worker_conn.close()
+        atexit.register(self.close)
+
+        threading.Thread(target=self._relay, daemon=True, name="SegmentsAnalyzerRelay").start()
+
+    def process(self, media_file, profile_name):
+        self._send("process", media_file, profile_name)
+
+    def prefetch(self, media_files, profile_name):
+        self._send("prefetch", list(media_files), profile_name)
+
+    #
+    # Commands are sent with the number of the file being processed, which a process command
+    # moves on
+    #
+    def _send(self, command, *args):
+        settings = {s: getattr(self.analyzer, s) for s in AnalyzerProcess.SETTINGS}
+        with self._send_lock:
+            if command == "process":
+                self._generation += 1
+            self._conn.send((command, self._generation) + args + (settings,))
+
+    def close(self):
+        if self._process.is_alive():
+            try:
+                with self._send_lock:
+                    self._conn.send(("quit",))
+            except (OSError, ValueError):
+                pass
+            self._process.join(timeout=1.0)
+            if self._process.is_alive():
+                self._process.terminate()
+
+    #
+    # Pass the messages from the worker about the file being processed on to the callbacks
+    #
+    def _relay(self):
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                return
+            kind, generation = message[0], message[1]
+            if generation != self._generation:
+                continue
+            if kind == "progress":
+                if self.analyzer.progress_callback is not None:
+                    self.analyzer.progress_callback(message[2])
+            elif kind == "segments":
+                if self.analyzer.segments_callback is not None:
+                    self.analyzer.segments_callback(*message[2:])
+            elif kind == "completed":
+                if self.analyzer.completed_callback is not None:
+                    self.analyzer.completed_callback(message[2])
+            elif kind == "failed":
+                if self.analyzer.progress_callback is not None:
+                    self.analyzer.progress_callback(0.0)
+                if self.analyzer.failed_callback is not None:
+                    self.analyzer.failed_callback(*message[2:])
+
+
+#
+# The worker process: analyse the files sent to it until told to quit or this end of the
+# pipe is closed
+#
+def _run_worker(conn):
+    from SWAP.segmentsanalyzer import SegmentsAnalyzer
+
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, ValueError):
+                pass
+
+    #
+    # The messages about a file carry the number it was sent with, which the analyzer hands
+    # back as the tag of the request
+    #
+    analyzer = SegmentsAnalyzer()
+    analyzer.progress_callback = lambda p: send("progress", analyzer.request_tag(), p)
+    analyzer.segments_callback = lambda s, from_time, to_time: send(
+            "segments", analyzer.request_tag(), s, from_time, to_time)
+    analyzer.completed_callback = lambda s: send("completed", analyzer.request_tag(), s)
+    analyzer.failed_callback = lambda file_name, error: send("failed", analyzer.request_tag(), file_name, error)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == "quit":
+            return
+        elif message[0] in ("process", "prefetch"):
+            command, generation, media, profile_name, settings = message
+            try:
+                for name, value in settings.items():
+                    setattr(analyzer, name, value)
+                analyzer.set_analyzer_profile(profile_name)
+                if command == "process":
+                    analyzer.process(media, generation)
+                else:
+                    analyzer.prefetch(media)
+            except Exception as e:
+                traceback.print_exc()
+                if command == "process":
+                    send("failed", generation, media, str(e))
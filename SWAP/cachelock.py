@@ -0,0 +1,89 @@
+"""
+Advisory locks on files in the cache, so that processes sharing the cache, such as the
+player and the library indexer, don't update the same entries or analyse the same file at
+the same time.
+
+The locks are flock locks, which belong to an open file rather than a process, so they also
+keep the threads of one process apart.  Where flock isn't available only the threads of this
+process are kept apart.
+"""
+
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class CacheLock:
+    POLL_INTERVAL = 0.1
+
+    #
+    # Without flock, a lock for each lock file shared by the threads of this process
+    #
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._file = None
+        self._thread_lock = None
+
+    #
+    # Wait for the lock.  If abandon is given it is checked while waiting and False is returned
+    # if it is set before the lock is acquired.
+    #
+    def acquire(self, abandon=None):
+        if fcntl is None:
+            return self._acquire_thread_lock(abandon)
+
+        f = open(self.lock_file, "a+b")
+        if abandon is None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self._file = f
+            return True
+
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file = f
+                return True
+            except BlockingIOError:
+                if abandon.wait(CacheLock.POLL_INTERVAL):
+                    f.close()
+                    return False
+
+    def _acquire_thread_lock(self, abandon):
+        with CacheLock._thread_locks_lock:
+            self._thread_lock = CacheLock._thread_locks.setdefault(self.lock_file, threading.Lock())
+        while not self._thread_lock.acquire(timeout=CacheLock.POLL_INTERVAL):
+            if abandon is not None and abandon.is_set():
+                return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        elif self._thread_lock is not None:
+            self._thread_lock.release()
+            self._thread_lock = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+if __name__ == "__main__":
+    lock = CacheLock("test.lock")
+    with lock:
+        abandon = threading.Event()
+        threading.Timer(0.5, abandon.set).start()
+        t = time.time()
+        print("Second lock acquired: {} after {:.1f}s".format(CacheLock("test.lock").acquire(abandon), time.time() - t))
@@ -0,0 +1,183 @@
+"""
+Compute the energy envelope of an audio signal, i.e. the mean power of each window of
+samples, using NumPy rather than a Python loop per window.
+
+The samples can be fed in blocks of any size, e.g. chunks of a memory mapped WAV file,
+and the energies of the windows that are complete are returned as each block is added.
+The result is the same as slicing the whole signal into windows and calculating the
+energy of each one.
+
+An envelope can itself be fed into an EnergyEnvelope (with squares=False) to combine it
+into longer windows, and saved to an EnvelopeFile that can be memory mapped.
+"""
+
+import os
+import struct
+import numpy as np
+
+
+class EnergyEnvelope:
+
+    #
+    # The energies are returned as dtype, float32 for an envelope that is to be saved and
+    # float64 where they are compared with a threshold
+    #
+    def __init__(self, window_size, step_size, max_energy=1.0, squares=True, dtype=np.float32):
+        if type(window_size) is not int or window_size <= 0:
+            raise AttributeError("Window size must be a positive integer.")
+        if type(step_size) is not int or step_size <= 0:
+            raise AttributeError("Step size must be a positive integer.")
+        self.window_size = window_size
+        self.step_size = step_size
+        self.max_energy = float(max_energy)
+        self.squares = squares
+        self.dtype = dtype
+
+        #
+        # The squared samples that haven't been consumed by a window yet, the absolute
+        # sample index of the first of them and the absolute index of the next window start
+        #
+        self._pending = np.zeros(0, dtype=np.int64)
+        self._pending_start = 0
+        self._next_window = 0
+        self.windows = 0
+
+    #
+    # The sum of the squares of each sample (row), with all of the channels summed together.
+    # Integer samples are squared as int64 so that the running sums are exact.
+    #
+    @staticmethod
+    def _squares(samples):
+        samples = np.asarray(samples)
+        if samples.dtype.kind in "iu" and samples.dtype.itemsize <= 2:
+            squares = np.square(samples, dtype=np.int64)
+        else:
+            squares = np.square(samples, dtype=np.float64)
+        if squares.ndim > 1:
+            squares = squares.reshape(len(squares), -1).sum(axis=1)
+        return squares
+
+    #
+    # Add the next block of samples and return the energies of any windows that are
+    # now complete.  As with the original generator, a window is only complete once
+    # there is at least one sample after its end.  Without squares the samples are
+    # taken to be energies already and the mean of each window is returned.
+    #
+    def feed(self, samples):
+        if self.squares:
+            squares = EnergyEnvelope._squares(samples)
+        else:
+            squares = np.asarray(samples, dtype=np.float64)
+        if len(self._pending) == 0:
+            self._pending = squares
+        else:
+            if squares.dtype != self._pending.dtype:
+                squares = squares.astype(np.float64)
+                self._pending = self._pending.astype(np.float64)
+            self._pending = np.concatenate((self._pending, squares))
+
+        first = self._next_window - self._pending_start
+        available = len(self._pending) - first - self.window_size - 1
+        if available < 0:
+            return np.zeros(0, dtype=self.dtype)
+        count = available // self.step_size + 1
+
+        cumulative = np.zeros(len(self._pending) + 1, dtype=self._pending.dtype)
+        np.cumsum(self._pending, out=cumulative[1:])
+        starts = first + np.arange(count, dtype=np.int64) * self.step_size
+        sums = cumulative[starts + self.window_size] - cumulative[starts]
+        energies = (sums / float(self.window_size)) / self.max_energy
+
+        #
+        # Drop the samples that no future window will need
+        #
+        self._next_window += count * self.step_size
+        self.windows += count
+        consumed = min(self._next_window - self._pending_start, len(self._pending))
+        self._pending = self._pending[consumed:]
+        self._pending_start += consumed
+
+        return energies.astype(self.dtype)
+
+    #
+    # Compute the whole envelope of a signal, chunk_size samples at a time
+    #
+    @staticmethod
+    def compute(samples, window_size, step_size, max_energy, chunk_size=1 << 20):
+        envelope = EnergyEnvelope(window_size, step_size, max_energy)
+        energies = [envelope.feed(samples[i:i + chunk_size]) for i in range(0, len(samples), chunk_size)]
+        if len(energies) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(energies)
+
+    #
+    # Combine an envelope into windows of window_size energies every step_size, taking the mean
+    # of each window.  The same windows are produced as when working from the samples.
+    #
+    @staticmethod
+    def aggregate(energies, window_size, step_size):
+        return EnergyEnvelope(window_size, step_size, squares=False, dtype=np.float64).feed(energies)
+
+
+#
+# An envelope saved as a small header, giving the sample rate and the number of samples
+# per value, followed by the float32 values so that they can be memory mapped
+#
+class EnvelopeFile:
+    MAGIC = b"SWAPENV1"
+    HEADER = struct.Struct("<8sII")
+
+    @staticmethod
+    def save(file_name, sample_rate, block_size, envelope):
+        with open(file_name, "wb") as f:
+            f.write(EnvelopeFile.HEADER.pack(EnvelopeFile.MAGIC, sample_rate, block_size))
+            f.write(np.asarray(envelope, dtype="<f4").tobytes())
+
+    #
+    # Open an envelope file to add values to, writing the header if it is new.  Anything after
+    # the last whole value, from being stopped part way through a write, is dropped.
+    #
+    @staticmethod
+    def open_append(file_name, sample_rate, block_size):
+        f = open(file_name, "ab")
+        size = f.tell()
+        if size < EnvelopeFile.HEADER.size:
+            f.truncate(0)
+            f.write(EnvelopeFile.HEADER.pack(EnvelopeFile.MAGIC, sample_rate, block_size))
+        elif (size - EnvelopeFile.HEADER.size) % 4 != 0:
+            f.truncate(size - (size - EnvelopeFile.HEADER.size) % 4)
+        return f
+
+    #
+    # Add values to an open envelope file, flushing them so that they are kept if the
+    # process stops
+    #
+    @staticmethod
+    def append(f, envelope):
+        f.write(np.asarray(envelope, dtype="<f4").tobytes())
+        f.flush()
+
+    #
+    # Returns the sample rate, block size and memory mapped envelope, or None if the file
+    # isn't an envelope file
+    #
+    @staticmethod
+    def load(file_name):
+        with open(file_name, "rb") as f:
+            header = f.read(EnvelopeFile.HEADER.size)
+        if len(header) < EnvelopeFile.HEADER.size:
+            return None
+        magic, sample_rate, block_size = EnvelopeFile.HEADER.unpack(header)
+        if magic != EnvelopeFile.MAGIC or sample_rate == 0 or block_size == 0:
+            return None
+        count = (os.path.getsize(file_name) - EnvelopeFile.HEADER.size) // 4
+        if count == 0:
+            return sample_rate, block_size, np.zeros(0, dtype=np.float32)
+        envelope = np.memmap(file_name, dtype="<f4", mode="r", offset=EnvelopeFile.HEADER.size, shape=(count,))
+        return sample_rate, block_size, envelope
+
+
+if __name__ == "__main__":
+    signal = (np.random.rand(100000, 2) * 2000 - 1000).astype(np.int16)
+    w = EnergyEnvelope.compute(signal, 4410, 3307, 32767.0 ** 2, chunk_size=7919)
+    print("{} windows, max energy {}".format(len(w), w.max()))
@@ -0,0 +1,78 @@
+"""
+Identify media files by their content rather than their path, so that the cached analysis
+of a file follows it when it is moved or renamed and isn't used once the file is changed.
+
+The fingerprint is a hash of the size of the file and a number of blocks spread through it,
+which is quick even for a large file.  The fingerprint of each path is kept in a SQLite index
+along with the size and modification time it was worked out for, so a file is only read
+again once it has changed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from appdirs import user_cache_dir
+
+
+class FingerprintIndex:
+    INDEX_NAME = "fingerprints.sqlite"
+
+    #
+    # The number and size of the blocks hashed, the whole file is hashed if it is smaller
+    #
+    SAMPLE_BLOCKS = 16
+    BLOCK_SIZE = 1 << 14
+
+    def __init__(self, index_file=None):
+        if index_file is None:
+            index_file = os.path.join(user_cache_dir('SWAP', '48clyde'), FingerprintIndex.INDEX_NAME)
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(index_file, timeout=10.0, check_same_thread=False)
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("CREATE TABLE IF NOT EXISTS paths "
+                            "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, fingerprint TEXT)")
+        self._index.commit()
+
+    #
+    # The fingerprint of a file, from the index if the file hasn't changed since it was worked out
+    #
+    def fingerprint(self, file_name):
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._index.execute("SELECT fingerprint FROM paths WHERE path = ? AND size = ? AND mtime = ?",
+                                      (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+
+        fingerprint = FingerprintIndex.compute(path, stat.st_size)
+        with self._lock:
+            with self._index:
+                self._index.execute("INSERT OR REPLACE INTO paths (path, size, mtime, fingerprint) VALUES (?, ?, ?, ?)",
+                                    (path, stat.st_size, stat.st_mtime_ns, fingerprint))
+        return fingerprint
+
+    @staticmethod
+    def compute(file_name, size):
+        digest = hashlib.sha1(str(size).encode())
+        with open(file_name, "rb") as f:
+            if size <= FingerprintIndex.SAMPLE_BLOCKS * FingerprintIndex.BLOCK_SIZE:
+                digest.update(f.read())
+            else:
+                last_block = size - FingerprintIndex.BLOCK_SIZE
+                for i in range(FingerprintIndex.SAMPLE_BLOCKS):
+                    f.seek(i * last_block // (FingerprintIndex.SAMPLE_BLOCKS - 1))
+                    digest.update(f.read(FingerprintIndex.BLOCK_SIZE))
+        return digest.hexdigest()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    fi = FingerprintIndex()
+    for name in sys.argv[1:]:
+        t = time.perf_counter()
+        print("{} {} {:.4f}s".format(fi.fingerprint(name), name, time.perf_counter() - t))
@@ -0,0 +1,151 @@
+"""
+An index of where each frame of an MP3 file starts and how many samples it holds, kept in
+the cache so that a file that has been opened before doesn't have to be scanned again.
+
+Given the index, libmpg123 can go straight to any frame rather than estimating where it is
+from the bit rate or a Xing table, which for a VBR file is inaccurate or means scanning the
+file, and the number of frames is known without reading the file.
+"""
+
+import os
+import struct
+import numpy as np
+from SWAP.mediacache import MediaCache
+from SWAP.fingerprintindex import FingerprintIndex
+from SWAP.mp3frames import Mp3Frames
+from SWAP.segmentstore import SegmentStore
+
+
+class FrameIndex:
+    MAGIC = b"SWAPIDX1"
+
+    #
+    # Magic, sample rate, channels and the number of frames, followed by the byte offset of
+    # each frame and then the number of samples in each frame
+    #
+    HEADER = struct.Struct("<8sIIQ")
+
+    def __init__(self, sample_rate, channels, offsets, frame_samples):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.frame_samples = np.asarray(frame_samples, dtype=np.int32)
+        self.sample_offsets = np.concatenate(([0], np.cumsum(self.frame_samples, dtype=np.int64)))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def from_frames(frames):
+        return FrameIndex(frames.sample_rate, frames.channels, frames.offsets, frames.frame_samples)
+
+    #
+    # The length of the file in seconds
+    #
+    def duration(self):
+        return float(self.sample_offsets[-1]) / self.sample_rate
+
+    def save(self, file_name):
+        with open(file_name, "wb") as f:
+            f.write(FrameIndex.HEADER.pack(FrameIndex.MAGIC, self.sample_rate, self.channels, len(self)))
+            f.write(self.offsets.astype("<i8").tobytes())
+            f.write(self.frame_samples.astype("<u2").tobytes())
+
+    #
+    # Returns the index in the file, or None if it isn't a frame index file
+    #
+    @staticmethod
+    def load(file_name):
+        with open(file_name, "rb") as f:
+            header = f.read(FrameIndex.HEADER.size)
+            if len(header) < FrameIndex.HEADER.size:
+                return None
+            magic, sample_rate, channels, count = FrameIndex.HEADER.unpack(header)
+            if magic != FrameIndex.MAGIC or sample_rate == 0:
+                return None
+            offsets = np.fromfile(f, dtype="<i8", count=count)
+            frame_samples = np.fromfile(f, dtype="<u2", count=count)
+        if len(offsets) != count or len(frame_samples) != count:
+            return None
+        return FrameIndex(sample_rate, channels, offsets, frame_samples)
+
+
+#
+# The frame indexes of the files, keyed by their content like the rest of the analysis.  As
+# many are kept as there are files in the segment store, so that a file whose segments are
+# kept still has its index.  An index is 10 bytes a frame, about 1.4MB an hour, so the size
+# limit allows for several hundred hours.
+#
+class FrameIndexCache:
+    KEY = "frames"
+    MAX_FILES = SegmentStore.MAX_ENTRIES
+    MAX_BYTES = 1 << 30
+
+    def __init__(self, fingerprints=None):
+        self.fingerprints = FingerprintIndex() if fingerprints is None else fingerprints
+        self.cache = MediaCache("frames", FrameIndexCache.MAX_BYTES, FrameIndexCache.MAX_FILES)
+
+    def _cache_key(self, media_file):
+        return os.path.join(self.fingerprints.fingerprint(media_file), FrameIndexCache.KEY)
+
+    def contains(self, media_file):
+        try:
+            return self.cache.is_file_in_cache(self._cache_key(media_file))
+        except OSError:
+            return False
+
+    #
+    # The index of the file from the cache, or None if it hasn't been cached
+    #
+    def get(self, media_file):
+        try:
+            key = self._cache_key(media_file)
+            if not self.cache.is_file_in_cache(key):
+                return None
+            return FrameIndex.load(self.cache.get_file_cache_name(key))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, media_file, index):
+        with self.cache.writing(self._cache_key(media_file)) as temp_file:
+            index.save(temp_file)
+
+    #
+    # The index of the file from the cache, or else from scanning the frames of the file, which
+    # is then cached.  Returns None if the file has no MP3 frames.
+    #
+    def get_or_build(self, media_file):
+        index = self.get(media_file)
+        if index is not None:
+            return index
+        try:
+            frames = Mp3Frames(media_file)
+        except (OSError, ValueError):
+            return None
+        return self.put_frames(media_file, frames)
+
+    #
+    # Cache the index of frames that have already been scanned
+    #
+    def put_frames(self, media_file, frames):
+        if len(frames) == 0:
+            return None
+        index = FrameIndex.from_frames(frames)
+        try:
+            self.put(media_file, index)
+        except OSError:
+            pass
+        return index
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    indexes = FrameIndexCache()
+    for name in sys.argv[1:]:
+        for attempt in ["Scanned", "Cached"]:
+            t = time.perf_counter()
+            index = indexes.get_or_build(name)
+            print("{} {} frames, {:.1f}s in {:.4f}s".format(
+                attempt, len(index), index.duration(), time.perf_counter() - t))
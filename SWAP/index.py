@@ -0,0 +1,117 @@
+"""
+Analyse the audio files in whole directories ahead of time, without the GUI, filling the
+segments cache that the player reads when a file is opened.
+
+    python -m SWAP.index [--profile standard] [--workers 4] directory ...
+
+Each file is analysed by one of a pool of worker processes.  Files whose segments are
+already cached for all of the profiles, and haven't changed since, are skipped.
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+from SWAP.segmentsanalyzer import SegmentsAnalyzer
+
+EXTENSIONS = [".mp3"]
+
+#
+# The analyzer of a worker process, created when the worker starts
+#
+_analyzer = None
+
+
+def _init_worker():
+    global _analyzer
+    _analyzer = SegmentsAnalyzer()
+    _analyzer.quick_analysis = False
+    _analyzer.incremental = False
+    #
+    # The files are already spread across the processes
+    #
+    _analyzer.workers = 1
+
+
+#
+# Analyse a file in a worker, returning the file name, its duration in seconds (None if not
+# known) and an error message if it couldn't be analysed
+#
+def _index_file(file_name, profile_names):
+    profiles = [_analyzer.analyzer_profiles[name] for name in profile_names]
+    try:
+        return file_name, _analyzer.analyze(file_name, profiles), None
+    except Exception as e:
+        return file_name, None, str(e)
+
+
+#
+# The audio files in the directories, in order
+#
+def find_files(directories, extensions):
+    for directory in directories:
+        if os.path.isfile(directory):
+            yield directory
+            continue
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for file in sorted(files):
+                if os.path.splitext(file)[1].lower() in extensions:
+                    yield os.path.join(root, file)
+
+
+def index(directories, profile_names, workers, extensions=EXTENSIONS, out=sys.stdout):
+    analyzer = SegmentsAnalyzer()
+    profiles = [analyzer.analyzer_profiles[name] for name in profile_names]
+
+    files = []
+    skipped = 0
+    for file_name in find_files(directories, extensions):
+        if all(analyzer.segments_cached(file_name, p) for p in profiles):
+            skipped += 1
+        else:
+            files.append(file_name)
+    print("{} files to index, {} already cached".format(len(files), skipped), file=out)
+
+    start = time.monotonic()
+    indexed = 0
+    failed = 0
+    audio_seconds = 0.0
+    if files:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker) as pool:
+            futures = [pool.submit(_index_file, f, profile_names) for f in files]
+            for future in concurrent.futures.as_completed(futures):
+                file_name, duration, error = future.result()
+                if error is not None:
+                    failed += 1
+                    print("Failed {}: {}".format(file_name, error), file=out)
+                    continue
+                indexed += 1
+                audio_seconds += duration or 0.0
+                print("[{}/{}] {}".format(indexed + failed, len(files), file_name), file=out)
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print("Indexed {} files ({} failed) in {:.1f}s: {:.2f} files/sec, {:.2f} audio-hours/sec".format(
+        indexed, failed, elapsed, indexed / elapsed, audio_seconds / 3600.0 / elapsed), file=out)
+    return indexed, skipped, failed
+
+
+if __name__ == "__main__":
+    profile_choices = [SegmentsAnalyzer.SHORT, SegmentsAnalyzer.STANDARD, SegmentsAnalyzer.LONG]
+    parser = argparse.ArgumentParser(prog="python -m SWAP.index", description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("directories", nargs="+", help="directories (or files) to index")
+    parser.add_argument("-p", "--profile", action="append", choices=profile_choices, dest="profiles",
+                        help="analyzer profile, may be repeated (default all)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes")
+    parser.add_argument("-e", "--extension", action="append", dest="extensions",
+                        help="file extension to index, may be repeated (default .mp3)")
+    args = parser.parse_args()
+
+    extensions = [e.lower() if e.startswith(".") else "." + e.lower() for e in args.extensions or EXTENSIONS]
+    index(args.directories, args.profiles or profile_choices, max(1, args.workers), extensions)
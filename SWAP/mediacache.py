@@ -1,17 +1,41 @@
 #
 # Provides a simple cache for media files.
 #
-# Note: only enforces space/size constraints on startup where the oldest files are deleted
+# The least recently used files are deleted to keep within the space/size constraints, before
+# a file is written if its size is known, otherwise as it is added.
 #
+# The sizes and times of the cached files are kept in a SQLite manifest in the cache directory,
+# so that starting up is a single read rather than a stat of every file.  If the manifest is
+# missing it is rebuilt from the files on disk.
+#
+# Several processes can share the cache.  Files are written under a temporary name and renamed
+# into place so that a half written file is never seen, and the files to evict are decided
+# from the manifest while holding a lock on it.
 #
 
 from appdirs import *
+import contextlib
 import pathlib
 import hashlib
+from collections import OrderedDict
 import shutil
+import sqlite3
+import threading
+import time
+from SWAP.cachelock import CacheLock
 
 
 class MediaCache:
+    MANIFEST_NAME = "manifest.sqlite"
+    LOCKS_DIR = "locks"
+    TEMP_SUFFIX = ".tmp"
+
+    #
+    # The access times of hits are written to the manifest together, once there are this many
+    # or the oldest is this many seconds old, rather than a write for every hit
+    #
+    ACCESS_FLUSH_COUNT = 32
+    ACCESS_FLUSH_SECONDS = 5.0
 
     def __init__(self, group, max_size=200000000, max_files=200):
         self.group = group
@@ -19,77 +43,284 @@ class MediaCache:
         self.max_files = max_files
         self.group_dir = os.path.join(user_cache_dir('SWAP', '48clyde'), group)
         pathlib.Path(self.group_dir).mkdir(parents=True, exist_ok=True)
-        self.cached = {}
+        pathlib.Path(self.group_dir, MediaCache.LOCKS_DIR).mkdir(exist_ok=True)
+        self._manifest_lock = CacheLock(os.path.join(self.group_dir, MediaCache.MANIFEST_NAME + ".lock"))
+        #
+        # The cached files, least recently used first, with their time and size
+        #
+        self.cached = OrderedDict()
+        self.cached_size = 0
+        self._lock = threading.RLock()
+
+        #
+        # The version of the manifest that the entries in memory were read from
+        #
+        self._data_version = None
+
+        #
+        # The access times of hits not yet written to the manifest, by name in the manifest
+        #
+        self._accessed = {}
+        self._accessed_since = None
+
+        #
+        # How long it took to find what is in the cache
+        #
+        start = time.perf_counter()
+        self._manifest = self.__open_manifest()
+        with self._manifest_lock:
+            self._data_version = self.__data_version()
+            if not self.__load_manifest():
+                self.__load_cache()
+                self.__save_manifest()
+            self.load_seconds = time.perf_counter() - start
+
+            self.__check_limits()
+
+    #
+    # Open the manifest, returning None if it can't be used.  A new manifest is marked as
+    # not loaded so that it is filled in from the files on disk.
+    #
+    def __open_manifest(self):
+        manifest_file = os.path.join(self.group_dir, MediaCache.MANIFEST_NAME)
+        try:
+            manifest = sqlite3.connect(manifest_file, timeout=10.0, check_same_thread=False)
+            manifest.execute("PRAGMA journal_mode=WAL")
+            manifest.execute("PRAGMA synchronous=NORMAL")
+            manifest.execute("CREATE TABLE IF NOT EXISTS entries "
+                             "(name TEXT PRIMARY KEY, key TEXT, size INTEGER, ctime REAL, accessed REAL)")
+            manifest.execute("CREATE TABLE IF NOT EXISTS state (loaded INTEGER)")
+            columns = [row[1] for row in manifest.execute("PRAGMA table_info(entries)")]
+            if "accessed" not in columns:
+                manifest.execute("ALTER TABLE entries ADD COLUMN accessed REAL")
+                manifest.execute("UPDATE entries SET accessed = ctime")
+            manifest.commit()
+            return manifest
+        except sqlite3.DatabaseError:
+            return None
+
+    #
+    # Read the entries from the manifest, replacing those in memory, as other processes may
+    # have changed it.  Returns False if it needs rebuilding.
+    #
+    def __load_manifest(self):
+        if self._manifest is None:
+            return False
+        self.cached.clear()
         self.cached_size = 0
-        self.__load_cache()
-        self.__check_limits()
+        try:
+            if self._manifest.execute("SELECT loaded FROM state").fetchone() is None:
+                return False
+            for name, size, ctime in self._manifest.execute(
+                    "SELECT name, size, ctime FROM entries ORDER BY accessed"):
+                self.cached[os.path.join(self.group_dir, name)] = (ctime, size)
+                self.cached_size += size
+        except sqlite3.DatabaseError:
+            self.cached.clear()
+            self.cached_size = 0
+            return False
+        return True
+
+    #
+    # Bring the entries in memory up to date with the changes other processes have made.  The
+    # data version of the manifest only changes when another connection writes to it, so it is
+    # only read again when it has been changed.
+    #
+    def __refresh(self):
+        if self._manifest is None:
+            return
+        self.__flush_accessed()
+        data_version = self.__data_version()
+        if data_version is None or data_version != self._data_version:
+            self._data_version = data_version
+            self.__load_manifest()
+
+    def __data_version(self):
+        if self._manifest is None:
+            return None
+        try:
+            return self._manifest.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.DatabaseError:
+            return None
 
     #
-    # See what files are on disk
+    # Write all of the entries to the manifest
+    #
+    def __save_manifest(self):
+        if self._manifest is None:
+            return
+        with self._manifest:
+            self._manifest.execute("DELETE FROM entries")
+            self._manifest.executemany(
+                "INSERT INTO entries (name, key, size, ctime, accessed) VALUES (?, NULL, ?, ?, ?)",
+                [(os.path.basename(f), size, ctime, ctime) for f, (ctime, size) in self.cached.items()])
+            self._manifest.execute("DELETE FROM state")
+            self._manifest.execute("INSERT INTO state (loaded) VALUES (1)")
+
+    #
+    # Write the access times of the hits since they were last written
+    #
+    def __flush_accessed(self):
+        if not self._accessed:
+            return
+        accessed = [(t, name) for name, t in self._accessed.items()]
+        self._accessed.clear()
+        self._accessed_since = None
+        if self._manifest is None:
+            return
+        try:
+            with self._manifest:
+                self._manifest.executemany("UPDATE entries SET accessed = ? WHERE name = ?", accessed)
+        except sqlite3.DatabaseError:
+            pass
+
+    def __manifest_update(self, sql, params):
+        if self._manifest is None:
+            return
+        try:
+            with self._manifest:
+                self._manifest.execute(sql, params)
+        except sqlite3.DatabaseError:
+            pass
+
+    #
+    # See what files are on disk, taking the oldest to be the least recently used
     #
     def __load_cache(self):
         self.cached.clear()
+        self.cached_size = 0
+        found = []
         for root, dirs, files in os.walk(self.group_dir):
+            if MediaCache.LOCKS_DIR in dirs:
+                dirs.remove(MediaCache.LOCKS_DIR)
             for file in files:
+                if file.startswith(MediaCache.MANIFEST_NAME) or file.endswith(MediaCache.TEMP_SUFFIX):
+                    continue
                 file_name = os.path.join(root, file)
                 stat = os.stat(file_name)
-                self.cached[file_name] = (stat.st_ctime, stat.st_size)
-                self.cached_size += stat.st_size
+                found.append((stat.st_ctime, stat.st_size, file_name))
+        for ctime, size, file_name in sorted(found):
+            self.cached[file_name] = (ctime, size)
+            self.cached_size += size
 
     #
     # Store a file in the cache
     #
     def store_file(self, file_name):
+        with self.writing(file_name) as temp_file:
+            shutil.copy(file_name, temp_file)
+
+    #
+    # Write a file into the cache: the body writes to the temporary file name given, which is
+    # then renamed to the cache name and added, or removed if there is an exception
+    #
+    @contextlib.contextmanager
+    def writing(self, file_name):
         fcn = self.get_file_cache_name(file_name)
-        shutil.copy(file_name, fcn)
+        temp_file = "{}.{}.{}{}".format(fcn, os.getpid(), threading.get_ident(), MediaCache.TEMP_SUFFIX)
+        try:
+            yield temp_file
+            os.replace(temp_file, fcn)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
         self.add_file(file_name)
 
     #
-    #
+    # Add a file that has been written to the cache, evicting others to make room for it
     #
     def add_file(self, file_name):
         fcn = self.get_file_cache_name(file_name)
         if os.path.exists(fcn):
-            stat = os.stat(fcn)
-            self.cached[fcn] = (stat.st_ctime, stat.st_size)
-            self.cached_size += stat.st_size
-            self.__check_limits(fcn)
+            with self._lock, self._manifest_lock:
+                self.__refresh()
+                self.__add_entry(fcn, file_name)
+                self.__check_limits(fcn)
 
     #
-    # Check the cache limits.
+    # A lock for the work on a file, such as analysing it, shared with other processes
     #
-    def __check_limits(self, exclude=None):
-        #
-        # File count limit reached?
-        #
-        ordered = sorted(self.cached, key=lambda cf: cf[1])
-
-        cl = len(self.cached)
-        if cl > self.max_files:
-            to_remove = ordered[0: cl - self.max_files]
-            for r in to_remove:
-                if r is not exclude:
-                    os.remove(r)
-                    self.cached_size -= self.cached[r][0]
-                    self.cached.pop(r)
-        #
-        # File size limit?
-        #
-        if self.cached_size > self.max_size:
-            for f in ordered:
-                if self.cached_size <= self.max_size:
-                    break
-                if f is not exclude:
-                    os.remove(f)
-                    self.cached_size -= self.cached[f][1]
-                    self.cached.pop(f)
+    def lock(self, file_name):
+        fcn = self.get_file_cache_name(file_name)
+        return CacheLock(os.path.join(self.group_dir, MediaCache.LOCKS_DIR, os.path.basename(fcn) + ".lock"))
+
+    def __add_entry(self, fcn, file_name):
+        stat = os.stat(fcn)
+        if fcn in self.cached:
+            self.cached_size -= self.cached.pop(fcn)[1]
+        self.cached[fcn] = (stat.st_ctime, stat.st_size)
+        self.cached_size += stat.st_size
+        self.__manifest_update(
+            "INSERT OR REPLACE INTO entries (name, key, size, ctime, accessed) VALUES (?, ?, ?, ?, ?)",
+            (os.path.basename(fcn), file_name, stat.st_size, stat.st_ctime, time.time()))
+
+    #
+    # Make room for a file of size bytes that is about to be written, so that the cache
+    # doesn't go over its size while it is being written.  There is no room for a file bigger
+    # than the cache, so nothing is evicted for it and False is returned.
+    #
+    def reserve(self, size):
+        if size > self.max_size:
+            return False
+        with self._lock, self._manifest_lock:
+            self.__refresh()
+            self.__check_limits(reserve=size)
+        return True
+
+    #
+    # Remove a file from the cache, if it is there
+    #
+    def remove_file(self, file_name):
+        fcn = self.get_file_cache_name(file_name)
+        with self._lock:
+            if fcn in self.cached:
+                self.cached_size -= self.cached.pop(fcn)[1]
+                self.__manifest_update("DELETE FROM entries WHERE name = ?", (os.path.basename(fcn),))
+            if os.path.exists(fcn):
+                os.remove(fcn)
+
+    #
+    # Check the cache limits, deleting the least recently used files apart from exclude until
+    # there are no more than max_files and there is room for reserve more bytes
+    #
+    def __check_limits(self, exclude=None, reserve=0):
+        while len(self.cached) > self.max_files or self.cached_size + reserve > self.max_size:
+            victim = next((f for f in self.cached if f != exclude), None)
+            if victim is None:
+                break
+            self.cached_size -= self.cached.pop(victim)[1]
+            self.__manifest_update("DELETE FROM entries WHERE name = ?", (os.path.basename(victim),))
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
 
     #
-    # See if the file is cached
+    # See if the file is cached.  A file added by another process since the manifest was read
+    # is picked up from the disk, and one that another process has evicted is dropped.
     #
     def is_file_in_cache(self, file_name):
         fcn = self.get_file_cache_name(file_name)
-        return fcn in self.cached
+        with self._lock:
+            if fcn in self.cached and not os.path.exists(fcn):
+                self.cached_size -= self.cached.pop(fcn)[1]
+                self.__manifest_update("DELETE FROM entries WHERE name = ?", (os.path.basename(fcn),))
+                return False
+            if fcn in self.cached:
+                self.cached.move_to_end(fcn)
+                now = time.time()
+                self._accessed[os.path.basename(fcn)] = now
+                if self._accessed_since is None:
+                    self._accessed_since = now
+                if len(self._accessed) >= MediaCache.ACCESS_FLUSH_COUNT or \
+                        now - self._accessed_since >= MediaCache.ACCESS_FLUSH_SECONDS:
+                    self.__flush_accessed()
+                return True
+            if os.path.exists(fcn):
+                self.__add_entry(fcn, file_name)
+                return True
+        return False
 
     #
     # Get the name of file in the cache, doesn't mean that the file is actually there
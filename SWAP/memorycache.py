@@ -0,0 +1,88 @@
+"""
+A least recently used cache of values in memory, limited to a number of bytes, that sits in
+front of the caches on disk so that flipping between a few files doesn't go back to the disk.
+
+The size of a value is worked out when it is added: the buffer of a NumPy array, or the
+objects in a list, tuple or dict added up.  The numbers of hits and misses are counted.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class MemoryCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    #
+    # The value for the key or None, making it the most recently used
+    #
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    #
+    # Add a value, evicting the least recently used ones to keep within max_bytes.  A value
+    # bigger than max_bytes isn't kept.
+    #
+    def put(self, key, value):
+        size = MemoryCache.size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _key, (_value, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    #
+    # The hits, misses, number of entries and bytes used
+    #
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self.bytes}
+
+    @staticmethod
+    def size_of(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(MemoryCache.size_of(v) for v in value)
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(MemoryCache.size_of(k) + MemoryCache.size_of(v)
+                                              for k, v in value.items())
+        return sys.getsizeof(value)
+
+
+if __name__ == "__main__":
+    mc = MemoryCache(1 << 20)
+    for i in range(10):
+        mc.put(i, np.zeros(40000, dtype=np.float32))
+    for i in range(10):
+        mc.get(i)
+    print(mc.stats())
@@ -0,0 +1,251 @@
+"""
+Scan the frames of an MP3 file without decoding them.
+
+Walks the MPEG audio frame headers to find where each frame starts and how many samples
+it holds, and for layer III reads the global gain, big values count and part2_3 length of
+each granule from the side information.  These give a rough estimate of the loudness of
+each frame in a fraction of the time it takes to decode the audio.
+
+https://www.mp3-tech.org/programmer/frame_header.html
+"""
+
+import mmap
+import os
+import numpy as np
+
+
+class Mp3Frames:
+    #
+    # Header tables, indexed by the version bits (0 = MPEG 2.5, 2 = MPEG 2, 3 = MPEG 1)
+    # and the layer bits (1 = layer III, 2 = layer II, 3 = layer I)
+    #
+    _SAMPLE_RATES = {
+        3: [44100, 48000, 32000],
+        2: [22050, 24000, 16000],
+        0: [11025, 12000, 8000]
+    }
+    _BITRATES = {
+        (3, 3): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        (3, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        (3, 1): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+        (2, 3): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        (2, 1): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    }
+    _SAMPLES_PER_FRAME = {
+        (3, 3): 384, (3, 2): 1152, (3, 1): 1152,
+        (2, 3): 384, (2, 2): 1152, (2, 1): 576,
+    }
+
+    #
+    # Layer III side information: the bit offset of the first granule/channel block and the
+    # length of each block, by (MPEG 1, mono)
+    #
+    _SIDE_INFO_LAYOUT = {
+        (True, True): (18, 59),
+        (True, False): (20, 59),
+        (False, True): (9, 63),
+        (False, False): (10, 63)
+    }
+
+    #
+    # The number of frequency lines in a granule and the global gain that gives a
+    # quantiser step of 1.0
+    #
+    _GRANULE_LINES = 576
+    _UNITY_GAIN = 210
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.sample_rate = 0
+        self.channels = 0
+        self.layer = 0
+        self.part2_3_length = np.zeros((0, 4), dtype=np.int32)
+        self.big_values = np.zeros((0, 4), dtype=np.int32)
+        self.global_gain = np.zeros((0, 4), dtype=np.int32)
+        self.granule_blocks = np.zeros(0, dtype=np.int32)
+
+        offsets = []
+        frame_samples = []
+        side_info = []
+        with open(file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    self._scan(data, offsets, frame_samples, side_info)
+                    self._read_side_info(data, side_info)
+
+        #
+        # Byte offset, number of samples and first sample of each frame
+        #
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.frame_samples = np.array(frame_samples, dtype=np.int32)
+        self.sample_offsets = np.concatenate(([0], np.cumsum(self.frame_samples, dtype=np.int64)[:-1])) \
+            if len(frame_samples) > 0 else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    #
+    # The total number of samples in the file
+    #
+    def sample_count(self):
+        return int(np.sum(self.frame_samples, dtype=np.int64))
+
+    #
+    # Walk the frame headers, re-synchronising on the next frame sync if a header is invalid.
+    # Until the frames are in sync, a header is only taken to be one if another follows it, as
+    # a sync word turns up by chance in other data.
+    #
+    def _scan(self, data, offsets, frame_samples, side_info):
+        size = len(data)
+        pos = Mp3Frames._skip_id3v2(data)
+        first_frame = True
+        synced = False
+        while pos + 4 <= size:
+            header = Mp3Frames._parse_header(data, pos)
+            if header is None or pos + header[0] > size or \
+                    (not synced and not Mp3Frames._followed_by_frame(data, pos, header[0])):
+                synced = False
+                next_sync = data.find(b"\xff", pos + 1)
+                if next_sync < 0:
+                    break
+                pos = next_sync
+                continue
+            synced = True
+            frame_length, samples, version, layer, mono, side_info_offset = header
+
+            #
+            # Skip a Xing/Info/VBRI frame at the start, it doesn't contain any audio
+            #
+            if first_frame:
+                first_frame = False
+                if data[pos + side_info_offset:pos + side_info_offset + 4] in (b"Xing", b"Info") or \
+                        data[pos + 36:pos + 40] == b"VBRI":
+                    pos += frame_length
+                    continue
+            if self.sample_rate == 0:
+                self.sample_rate = Mp3Frames._SAMPLE_RATES[version][(data[pos + 2] >> 2) & 0x3]
+                self.channels = 1 if mono else 2
+                self.layer = 4 - layer
+
+            offsets.append(pos)
+            frame_samples.append(samples)
+            if layer == 1:
+                side_info.append((pos + side_info_offset - Mp3Frames._side_info_length(version, mono),
+                                  version == 3, mono))
+            pos += frame_length
+
+    #
+    # Decode a 4 byte frame header returning the frame length, the number of samples, the
+    # version and layer bits, whether it is mono and the offset of the end of the side
+    # information, or None if it isn't a valid header
+    #
+    @staticmethod
+    def _parse_header(data, pos):
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        if data[pos] != 0xff or (b1 & 0xe0) != 0xe0:
+            return None
+        version = (b1 >> 3) & 0x3
+        layer = (b1 >> 1) & 0x3
+        bitrate_index = (b2 >> 4) & 0xf
+        rate_index = (b2 >> 2) & 0x3
+        if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+            return None
+
+        table_version = 3 if version == 3 else 2
+        bitrate = Mp3Frames._BITRATES[(table_version, layer)][bitrate_index] * 1000
+        sample_rate = Mp3Frames._SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 0x1
+        samples = Mp3Frames._SAMPLES_PER_FRAME[(table_version, layer)]
+        if layer == 3:
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+        mono = (b3 >> 6) == 3
+        crc = 0 if b1 & 0x1 else 2
+        side_info_offset = 4 + crc + (Mp3Frames._side_info_length(version, mono) if layer == 1 else 0)
+        return frame_length, samples, version, layer, mono, side_info_offset
+
+    #
+    # Whether the frame at pos is followed by the header of a frame of the same version, layer
+    # and sample rate, or by the end of the file or an ID3v1 tag
+    #
+    @staticmethod
+    def _followed_by_frame(data, pos, frame_length):
+        next_pos = pos + frame_length
+        if next_pos + 4 > len(data) or data[next_pos:next_pos + 3] == b"TAG":
+            return True
+        return Mp3Frames._parse_header(data, next_pos) is not None and \
+            (data[next_pos + 1] & 0xfe) == (data[pos + 1] & 0xfe) and \
+            (data[next_pos + 2] & 0x0c) == (data[pos + 2] & 0x0c)
+
+    @staticmethod
+    def _side_info_length(version, mono):
+        if version == 3:
+            return 17 if mono else 32
+        return 9 if mono else 17
+
+    @staticmethod
+    def _skip_id3v2(data):
+        if len(data) >= 10 and data[0:3] == b"ID3":
+            size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+            footer = 10 if data[5] & 0x10 else 0
+            return 10 + size + footer
+        return 0
+
+    #
+    # Read part2_3_length (12 bits), big_values (9 bits) and global_gain (8 bits) of every
+    # granule/channel block of the layer III frames, a layout at a time using NumPy
+    #
+    def _read_side_info(self, data, side_info):
+        count = len(side_info)
+        self.part2_3_length = np.zeros((count, 4), dtype=np.int32)
+        self.big_values = np.zeros((count, 4), dtype=np.int32)
+        self.global_gain = np.zeros((count, 4), dtype=np.int32)
+        self.granule_blocks = np.zeros(count, dtype=np.int32)
+        if count == 0:
+            return
+
+        raw = np.frombuffer(data, dtype=np.uint8)
+        starts = np.array([s[0] for s in side_info], dtype=np.int64)
+        layouts = np.array([(s[1] << 1) | s[2] for s in side_info], dtype=np.int8)
+        for (mpeg1, mono), (first_bit, block_bits) in Mp3Frames._SIDE_INFO_LAYOUT.items():
+            rows = np.flatnonzero(layouts == ((mpeg1 << 1) | mono))
+            if len(rows) == 0:
+                continue
+            blocks = (2 if mpeg1 else 1) * (1 if mono else 2)
+            self.granule_blocks[rows] = blocks
+            for block in range(blocks):
+                bit = first_bit + block * block_bits
+                byte_index = starts[rows] + bit // 8
+                value = np.zeros(len(rows), dtype=np.int64)
+                for i in range(5):
+                    value = (value << 8) | raw[np.minimum(byte_index + i, len(raw) - 1)]
+                value >>= 40 - 29 - bit % 8
+                self.global_gain[rows, block] = value & 0xff
+                self.big_values[rows, block] = (value >> 8) & 0x1ff
+                self.part2_3_length[rows, block] = (value >> 17) & 0xfff
+
+    #
+    # Estimate the mean energy of each frame relative to a full scale signal.  The global
+    # gain sets the quantiser step size and big_values how many of the frequency lines are
+    # coded, so a granule with no coded bits is silent.  This is only a rough guide to
+    # the loudness and isn't calibrated against the decoded energy.
+    #
+    def loudness(self):
+        if self.layer != 3 or len(self.global_gain) == 0:
+            return None
+        step_energy = np.power(2.0, (self.global_gain - Mp3Frames._UNITY_GAIN) / 2.0)
+        coded_lines = np.minimum(2 * self.big_values + 1, Mp3Frames._GRANULE_LINES) / Mp3Frames._GRANULE_LINES
+        energy = np.where(self.part2_3_length > 0, step_energy * coded_lines, 0.0)
+        blocks = np.maximum(self.granule_blocks, 1)
+        return (energy.sum(axis=1) / blocks * (1 if self.channels == 1 else 2)).astype(np.float32)
+
+
+if __name__ == "__main__":
+    import time
+
+    t = time.time()
+    frames = Mp3Frames("sample.mp3")
+    print("{} frames, {} samples at {} Hz in {:.2f}s".format(
+        len(frames), frames.sample_count(), frames.sample_rate, time.time() - t))
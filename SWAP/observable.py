@@ -23,6 +23,14 @@ class Observable:
             self.data = data
             self._docallbacks()
 
+    #
+    # Notify the callbacks of the data even if it is the same as the previous value, for
+    # values that describe an event rather than a state
+    #
+    def notify(self, data):
+        self.data = data
+        self._docallbacks()
+
     def get(self):
         return self.data
 
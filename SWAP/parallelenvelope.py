@@ -0,0 +1,109 @@
+"""
+Compute the envelope of a long audio file on several processes.
+
+The file is split into chunks of whole envelope blocks and each worker works out the
+envelope of its own chunk, which are stitched together in order.  No samples are passed
+between processes, each worker reads them itself.
+
+A converted file is read from its PcmFile in the cache, which starts at any sample, so the
+stitched envelope is exactly the same as working through the whole file in one go.
+
+An MP3 is decoded by each worker from a seek a couple of frames before its chunk, with the
+samples before the chunk thrown away.  The bit reservoir means that a decoder started part
+way through isn't guaranteed to give exactly the same samples as one that decoded the file
+from the start, so the envelope of the first blocks of a chunk may differ slightly from
+decoding in one go.  The tests allow a difference of up to 0.1% of the loudest block.
+"""
+
+import concurrent.futures
+import numpy as np
+
+from SWAP.energyenvelope import EnergyEnvelope
+from SWAP.pcmfile import PcmFile
+from SWAP.player import ExtMpg123
+
+#
+# The number of samples decoded and thrown away before the start of a chunk, a couple of
+# layer III frames at the highest rate, and the size of the blocks decoded, which the serial
+# analysis uses as well
+#
+PREROLL_SAMPLES = 2 * 1152
+DECODE_BLOCK_BYTES = 1 << 18
+
+
+#
+# The envelope of block_count blocks (or to the end if None) from first_block of an MP3.
+# The file is decoded in the same mode as for the serial analysis.
+#
+def mp3_chunk(source_args, first_block, block_count, block_size, max_energy):
+    file_name, min_rate = source_args
+    mp3 = ExtMpg123()
+    try:
+        _rate, channels, _file_channels = mp3.open_for_analysis(file_name, min_rate)
+
+        first_sample = first_block * block_size
+        preroll = min(first_sample, PREROLL_SAMPLES)
+        if first_sample > 0:
+            try:
+                mp3.seek(first_sample - preroll)
+            except ExtMpg123.LengthException:
+                # the file is shorter than estimated
+                return np.zeros(0, dtype=np.float32)
+
+        blocks = (np.frombuffer(b, dtype=np.int16).reshape(-1, channels) for b in mp3.iter_blocks(DECODE_BLOCK_BYTES))
+        return _chunk_envelope(blocks, preroll, block_count, block_size, max_energy)
+    finally:
+        mp3.close()
+
+
+#
+# The envelope of block_count blocks (or to the end if None) from first_block of a PcmFile
+#
+def pcm_chunk(source_args, first_block, block_count, block_size, max_energy):
+    pcm_file, = source_args
+    first_sample = first_block * block_size
+    last_sample = None if block_count is None else first_sample + (block_count + 1) * block_size
+    blocks = PcmFile(pcm_file).iter_blocks(first_sample, last_sample)
+    return _chunk_envelope(blocks, 0, block_count, block_size, max_energy)
+
+
+def _chunk_envelope(blocks, skip, block_count, block_size, max_energy):
+    envelope = EnergyEnvelope(block_size, block_size, max_energy)
+    energies = []
+    for samples in blocks:
+        if skip > 0:
+            cut = min(skip, len(samples))
+            samples = samples[cut:]
+            skip -= cut
+        energies.append(envelope.feed(samples))
+        if block_count is not None and envelope.windows >= block_count:
+            break
+    energies = np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+    return energies if block_count is None else energies[:block_count]
+
+
+#
+# Split the file from first_block on into chunks, have the pool work out their envelopes and
+# yield each one in order along with the number of samples covered so far.  Stops early if
+# abandon is set.
+#
+def iter_envelope(pool, worker, source_args, sample_count, block_size, max_energy, chunks, abandon, first_block=0):
+    total_blocks = sample_count // block_size
+    chunk_blocks = max(1, -(-(total_blocks - first_block) // chunks))
+    futures = []
+    for chunk_start in range(first_block, max(total_blocks, first_block + 1), chunk_blocks):
+        block_count = chunk_blocks if chunk_start + chunk_blocks < total_blocks else None
+        futures.append((chunk_start, pool.submit(
+            worker, source_args, chunk_start, block_count, block_size, max_energy)))
+
+    for chunk_start, future in futures:
+        while True:
+            try:
+                energies = future.result(timeout=0.2)
+                break
+            except concurrent.futures.TimeoutError:
+                if abandon.is_set():
+                    for _chunk_start, f in futures:
+                        f.cancel()
+                    return
+        yield energies, min(sample_count, (chunk_start + len(energies)) * block_size)
@@ -0,0 +1,123 @@
+"""
+A compact file of 16 bit mono samples for analysing files that mpg123 can't decode, so that
+they don't have to be converted again each time they are analysed.
+
+The samples are stored in blocks, each of which can be compressed on its own, with an index
+of where each block starts so that reading can start at any sample.  Compression takes the
+difference between neighbouring samples, which is small for audio, and deflates it, so it is
+lossless.
+"""
+
+import struct
+import zlib
+import numpy as np
+
+
+class PcmFile:
+    MAGIC = b"SWAPPCM1"
+
+    #
+    # Magic, sample rate, samples per block, whether the blocks are compressed, the number of
+    # channels mixed down and the number of samples, followed by the offsets of the blocks and
+    # the end of the last block
+    #
+    HEADER = struct.Struct("<8sIIIIQ")
+    BLOCK_SAMPLES = 1 << 16
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            header = f.read(PcmFile.HEADER.size)
+            if len(header) < PcmFile.HEADER.size:
+                raise ValueError("Not a PCM file")
+            magic, self.sample_rate, self.block_samples, self.compressed, self.source_channels, \
+                self.sample_count = PcmFile.HEADER.unpack(header)
+            if magic != PcmFile.MAGIC or self.sample_rate == 0 or self.block_samples == 0:
+                raise ValueError("Not a PCM file")
+            blocks = -(-self.sample_count // self.block_samples)
+            self.offsets = np.frombuffer(f.read(8 * (blocks + 1)), dtype="<u8")
+            if len(self.offsets) != blocks + 1:
+                raise ValueError("Truncated PCM file")
+
+    def __len__(self):
+        return self.sample_count
+
+    @staticmethod
+    def save(file_name, sample_rate, samples, source_channels=1, compress=True, block_samples=BLOCK_SAMPLES):
+        samples = np.asarray(samples, dtype="<i2").reshape(-1)
+        blocks = -(-len(samples) // block_samples)
+        offsets = np.zeros(blocks + 1, dtype="<u8")
+        with open(file_name, "wb") as f:
+            f.write(PcmFile.HEADER.pack(PcmFile.MAGIC, sample_rate, block_samples, int(compress), source_channels,
+                                        len(samples)))
+            f.seek(PcmFile.HEADER.size + offsets.nbytes)
+            offsets[0] = f.tell()
+            for i in range(blocks):
+                block = samples[i * block_samples:(i + 1) * block_samples]
+                if compress:
+                    data = zlib.compress(np.diff(block, prepend=np.int16(0)).astype("<i2").tobytes(),
+                                         PcmFile.COMPRESSION_LEVEL)
+                else:
+                    data = block.tobytes()
+                f.write(data)
+                offsets[i + 1] = f.tell()
+            f.seek(PcmFile.HEADER.size)
+            f.write(offsets.tobytes())
+
+    #
+    # The size of the file that save would write, estimated from compressing a few blocks
+    # spread through the samples
+    #
+    ESTIMATE_BLOCKS = 4
+
+    @staticmethod
+    def estimated_size(samples, compress=True, block_samples=BLOCK_SAMPLES):
+        samples = np.asarray(samples, dtype="<i2").reshape(-1)
+        blocks = -(-len(samples) // block_samples)
+        header_size = PcmFile.HEADER.size + 8 * (blocks + 1)
+        if not compress or blocks == 0:
+            return header_size + samples.nbytes
+        sampled = sorted(set(np.linspace(0, blocks - 1, min(blocks, PcmFile.ESTIMATE_BLOCKS)).astype(int)))
+        sampled_bytes = 0
+        compressed_bytes = 0
+        for i in sampled:
+            block = samples[i * block_samples:(i + 1) * block_samples]
+            sampled_bytes += block.nbytes
+            compressed_bytes += len(zlib.compress(np.diff(block, prepend=np.int16(0)).astype("<i2").tobytes(),
+                                                  PcmFile.COMPRESSION_LEVEL))
+        return header_size + int(samples.nbytes * compressed_bytes / sampled_bytes)
+
+    #
+    # Yield the samples from first_sample up to last_sample (or the end) a block at a time,
+    # each as a column of samples
+    #
+    def iter_blocks(self, first_sample=0, last_sample=None):
+        last_sample = self.sample_count if last_sample is None else min(last_sample, self.sample_count)
+        if first_sample >= last_sample:
+            return
+        with open(self.file_name, "rb") as f:
+            for block in range(first_sample // self.block_samples, -(-last_sample // self.block_samples)):
+                f.seek(int(self.offsets[block]))
+                data = f.read(int(self.offsets[block + 1] - self.offsets[block]))
+                if self.compressed:
+                    samples = np.cumsum(np.frombuffer(zlib.decompress(data), dtype="<i2"), dtype=np.int16)
+                else:
+                    samples = np.frombuffer(data, dtype="<i2")
+                block_start = block * self.block_samples
+                samples = samples[max(0, first_sample - block_start):last_sample - block_start]
+                yield samples.reshape(-1, 1)
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    signal = (np.sin(np.arange(22050 * 60) / 20.0) * 8000 * np.random.rand(22050 * 60)).astype(np.int16)
+    t = time.time()
+    PcmFile.save("test.pcm", 22050, signal)
+    print("Saved {} bytes for {} bytes of samples in {:.2f}s".format(
+        os.path.getsize("test.pcm"), signal.nbytes, time.time() - t))
+    restored = np.concatenate(list(PcmFile("test.pcm").iter_blocks(12345)))
+    print("Lossless: {}".format(np.array_equal(restored[:, 0], signal[12345:])))
+    os.remove("test.pcm")
@@ -0,0 +1,276 @@
+"""
+Keep the decoded samples of the segments around the current position in memory, so that
+repeating a segment or stepping on to the next one plays straight away rather than waiting
+for the decoder to seek and decode it again.
+
+A thread decodes the current segment and the ones either side of it with its own decoder as
+the position moves, starting with the current segment and then those ahead of it.  When the
+ring is over its size the segments furthest from the current position are dropped.
+
+The volume is applied as the samples are decoded, so the ring is emptied when it changes.
+"""
+
+import bisect
+import ctypes
+import threading
+import mpg123
+
+
+#
+# The decoded samples of a segment in the output format of the decoder, at the volume they
+# were decoded at
+#
+class PcmSegment:
+    def __init__(self, start, end, rate, channels, encoding, sample_bytes, pcm, size, volume=None):
+        self.start = start
+        self.end = end
+        self.format = (rate, channels, encoding)
+        self.rate = rate
+        self.sample_bytes = sample_bytes
+        self.pcm = pcm
+        self.size = size
+        self.volume = volume
+
+    #
+    # The address of the samples at a byte offset, to hand to the output without copying them
+    #
+    def address(self, offset=0):
+        return ctypes.addressof(self.pcm) + offset
+
+    #
+    # The byte offset of a time in the segment, on a sample boundary, and the time of an offset
+    #
+    def offset(self, tsec):
+        samples = int(round((tsec - self.start) * self.rate))
+        return max(0, min(self.size, samples * self.sample_bytes))
+
+    def time_at(self, offset):
+        return self.start + offset / self.sample_bytes / self.rate
+
+
+class PcmRing:
+    #
+    # The segments either side of the current one that are kept decoded
+    #
+    SEGMENTS_BEFORE = 1
+    SEGMENTS_AFTER = 2
+
+    #
+    # How close a time has to be to the start of a segment to be played from the ring, and the
+    # longest segment worth decoding into it
+    #
+    TOLERANCE = 0.001
+    MAX_SEGMENT_DURATION = 60.0
+
+    DECODE_ERRORS = (mpg123.Mpg123.OpenFileException, mpg123.Mpg123.FormatException, mpg123.Mpg123.LengthException,
+                     mpg123.Mpg123.DecodeException, mpg123.Mpg123.NeedMoreException, mpg123.Mpg123.ID3Exception)
+
+    #
+    # open_decoder(file_name, frame_index) returns a decoder opened on the file, separate from
+    # the one that is playing
+    #
+    def __init__(self, max_bytes, open_decoder):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._open_decoder = open_decoder
+        self._file_name = None
+        self._frame_index = None
+        self._track_length = 0.0
+        self._segments = []
+        self._segments_file = None
+        self._position = 0.0
+        self._generation = 0
+
+        #
+        # The volume to decode at, None to leave the decoders at theirs
+        #
+        self.volume = None
+
+        #
+        # The decoded segments by their start time, and the starts that couldn't be decoded
+        #
+        self._entries = {}
+        self._failed = set()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run_filler, daemon=True, name="PcmRing").start()
+
+    #
+    # A new file has been loaded, forget the segments of the last one.  Segments that were set
+    # for the file before it was loaded are kept.
+    #
+    def load(self, file_name, frame_index, track_length):
+        with self._condition:
+            self._file_name = file_name
+            self._frame_index = frame_index
+            self._track_length = track_length
+            if self._segments_file != file_name:
+                self._segments = []
+                self._segments_file = file_name
+            self._position = 0.0
+            self._clear()
+            self._condition.notify()
+
+    #
+    # The volume has changed, the segments decoded at the old one are dropped
+    #
+    def set_volume(self, volume):
+        with self._condition:
+            if volume == self.volume:
+                return
+            self.volume = volume
+            self._clear()
+            self._condition.notify()
+
+    #
+    # The segments of a file, which may be set before the file is loaded, or of the loaded file
+    # if file_name is None
+    #
+    def set_segments(self, segments, file_name=None):
+        with self._condition:
+            self._segments = list(segments)
+            self._segments_file = self._file_name if file_name is None else file_name
+            self._failed.clear()
+            self._condition.notify()
+
+    #
+    # The position has moved, decode the segments around it
+    #
+    def move_to(self, tsec):
+        with self._condition:
+            self._position = tsec
+            self._condition.notify()
+
+    #
+    # The decoded segment that starts at from_time and lasts until at least to_time, or None
+    # if it isn't in the ring
+    #
+    def get(self, from_time, to_time):
+        with self._condition:
+            for start, entry in self._entries.items():
+                if abs(start - from_time) < PcmRing.TOLERANCE and entry.end >= to_time - PcmRing.TOLERANCE:
+                    return entry
+        return None
+
+    #
+    # The decoded samples from from_time to to_time, from the ring or else decoded in the calling
+    # thread with a decoder of its own and added to the ring.  Returns None if they can't be decoded.
+    #
+    def decode(self, from_time, to_time):
+        entry = self.get(from_time, to_time)
+        if entry is not None:
+            return entry
+        with self._condition:
+            file_name, frame_index, generation = self._file_name, self._frame_index, self._generation
+            volume = self.volume
+        if file_name is None or to_time <= from_time:
+            return None
+        try:
+            entry = PcmRing._decode(self._open_decoder(file_name, frame_index), from_time, to_time, volume)
+        except PcmRing.DECODE_ERRORS:
+            return None
+        with self._condition:
+            if generation == self._generation and from_time not in self._entries:
+                self._entries[from_time] = entry
+                self.bytes += entry.size
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _clear(self):
+        self._generation += 1
+        self._entries = {}
+        self._failed = set()
+        self.bytes = 0
+
+    #
+    # The start and end of the segments around the position, the current segment first, then
+    # those after it and then those before it
+    #
+    def _window(self):
+        if self._file_name is None or self._segments_file != self._file_name or len(self._segments) == 0:
+            return []
+        current = max(0, bisect.bisect_right(self._segments, self._position) - 1)
+        wanted = [current + i for i in range(PcmRing.SEGMENTS_AFTER + 1)] + \
+                 [current - i for i in range(1, PcmRing.SEGMENTS_BEFORE + 1)]
+        window = []
+        for ix in wanted:
+            if 0 <= ix < len(self._segments):
+                end = self._segments[ix + 1] if ix + 1 < len(self._segments) else self._track_length
+                window.append((self._segments[ix], end))
+        return window
+
+    #
+    # The next segment of the window that isn't decoded, or None if they all are or the ring
+    # is full of them
+    #
+    def _next_missing(self):
+        window = self._window()
+        self._evict(set(start for start, _end in window))
+        if self.bytes >= self.max_bytes:
+            return None
+        for start, end in window:
+            if start in self._entries or start in self._failed:
+                continue
+            if end <= start or end - start > PcmRing.MAX_SEGMENT_DURATION:
+                self._failed.add(start)
+                continue
+            return start, end
+        return None
+
+    #
+    # Drop the segments furthest from the position, apart from those to keep, until the ring
+    # is within its size
+    #
+    def _evict(self, keep):
+        while self.bytes > self.max_bytes:
+            others = [start for start in self._entries if start not in keep]
+            if len(others) == 0:
+                break
+            start = max(others, key=lambda s: abs(s - self._position))
+            self.bytes -= self._entries.pop(start).size
+
+    def _run_filler(self):
+        decoder = None
+        decoder_file = None
+        while True:
+            with self._condition:
+                segment = self._next_missing()
+                while segment is None:
+                    self._condition.wait()
+                    segment = self._next_missing()
+                file_name, frame_index, generation = self._file_name, self._frame_index, self._generation
+                volume = self.volume
+
+            start, end = segment
+            try:
+                if decoder_file != file_name:
+                    decoder = None
+                    decoder = self._open_decoder(file_name, frame_index)
+                    decoder_file = file_name
+                entry = PcmRing._decode(decoder, start, end, volume)
+            except PcmRing.DECODE_ERRORS:
+                entry = None
+                decoder_file = None
+
+            with self._condition:
+                if generation != self._generation:
+                    continue
+                if entry is None:
+                    self._failed.add(start)
+                    continue
+                self._entries[start] = entry
+                self.bytes += entry.size
+
+    @staticmethod
+    def _decode(decoder, start, end, volume=None):
+        if volume is not None:
+            decoder.set_volume(volume)
+        rate, channels, encoding = decoder.get_format()
+        sample_bytes = channels * decoder.encoding_size(encoding)
+        first = int(round(start * rate))
+        size = (int(round(end * rate)) - first) * sample_bytes
+        pcm = ctypes.create_string_buffer(size)
+        decoder.seek(first)
+        size = decoder.read_into(pcm, size)
+        return PcmSegment(start, end, rate, channels, encoding, sample_bytes, pcm, size, volume)
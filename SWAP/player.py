@@ -5,11 +5,15 @@ the current position and supporting the pausing and resumption of playback that
 are not exposed or wrapped by mpg123.py
 
 """
+import collections
 import ctypes
 from enum import Enum
 import threading
 import queue
+import time
 import mpg123
+from SWAP.frameindex import FrameIndexCache
+from SWAP.pcmring import PcmRing
 
 
 class mpg123_frameinfo(ctypes.Structure):
@@ -31,6 +35,43 @@ class mpg123_frameinfo(ctypes.Structure):
     ]
 
 
+#
+# The timing of a file, taken once when it is loaded so that frame numbers and times can be
+# converted without asking the decoder.  Every frame of a file holds the same number of samples.
+#
+class TrackTiming:
+    def __init__(self, rate, samples_per_frame, frames):
+        self.rate = rate
+        self.samples_per_frame = samples_per_frame
+        self.frames = frames
+        self.length = self.frame_seconds(frames)
+
+    @staticmethod
+    def from_index(frame_index):
+        return TrackTiming(frame_index.sample_rate, int(frame_index.frame_samples[0]), len(frame_index))
+
+    def frame_seconds(self, frame):
+        return frame * self.samples_per_frame / self.rate
+
+    #
+    # The frame that holds the time, as mpg123_timeframe.  The time is taken to the nearest
+    # sample, as when seeking to it, so that the start time of a frame is in that frame.
+    #
+    def timeframe(self, tsec):
+        return int(round(tsec * self.rate)) // self.samples_per_frame
+
+
+#
+# Set the argument and result types of library functions from a table of
+# name: (argtypes, restype)
+#
+def declare_functions(lib, functions):
+    for name, (argtypes, restype) in functions.items():
+        function = getattr(lib, name)
+        function.argtypes = argtypes
+        function.restype = restype
+
+
 #
 # Extensions to Mpg123 to get access to positioning functions
 #
@@ -39,11 +80,63 @@ class ExtMpg123(mpg123.Mpg123):
     SEEK_CURRENT = 1
     SEEK_END = 2
 
+    #
+    # Parameters and flags for mpg123_param
+    #
+    # https://www.mpg123.de/api/group__mpg123__init.shtml
+    #
+    ADD_FLAGS = 2
+    FORCE_RATE = 3
+    DOWN_SAMPLE = 4
+    MONO_MIX = 0x4
+
+    #
+    # The argument and result types of the functions used by the extensions, so that ctypes
+    # passes the arguments as they are rather than working out how to convert them on each call
+    #
+    _FUNCTIONS = {
+        "mpg123_open": ([ctypes.c_void_p, ctypes.c_char_p], ctypes.c_int),
+        "mpg123_seek": ([ctypes.c_void_p, ctypes.c_long, ctypes.c_int], ctypes.c_long),
+        "mpg123_timeframe": ([ctypes.c_void_p, ctypes.c_double], ctypes.c_long),
+        "mpg123_seek_frame": ([ctypes.c_void_p, ctypes.c_long, ctypes.c_int], ctypes.c_long),
+        "mpg123_tellframe": ([ctypes.c_void_p], ctypes.c_long),
+        "mpg123_set_index": ([ctypes.c_void_p, ctypes.POINTER(ctypes.c_long), ctypes.c_long, ctypes.c_size_t],
+                             ctypes.c_int),
+        "mpg123_info": ([ctypes.c_void_p, ctypes.POINTER(mpg123_frameinfo)], ctypes.c_int),
+        "mpg123_format_none": ([ctypes.c_void_p], ctypes.c_int),
+        "mpg123_format": ([ctypes.c_void_p, ctypes.c_long, ctypes.c_int, ctypes.c_int], ctypes.c_int),
+        "mpg123_param": ([ctypes.c_void_p, ctypes.c_int, ctypes.c_long, ctypes.c_double], ctypes.c_int),
+        "mpg123_read": ([ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_size_t)],
+                        ctypes.c_int),
+        "mpg123_getvolume": ([ctypes.c_void_p, ctypes.POINTER(ctypes.c_double), ctypes.POINTER(ctypes.c_double),
+                              ctypes.POINTER(ctypes.c_double)], ctypes.c_int),
+        "mpg123_volume": ([ctypes.c_void_p, ctypes.c_double], ctypes.c_int),
+        "mpg123_encsize": ([ctypes.c_int], ctypes.c_int),
+        "mpg123_close": ([ctypes.c_void_p], ctypes.c_int),
+        "mpg123_delete": ([ctypes.c_void_p], None),
+    }
+
     def __init__(self, filename=None, library_path=None):
         try:
             super().__init__(filename, library_path)
         except ExtMpg123.LibInitializationException:
             super().__init__(filename, "/opt/local/lib/libmpg123.dylib")
+        declare_functions(self._lib, ExtMpg123._FUNCTIONS)
+
+    #
+    # Close the file and free the handle.  Mpg123 only closes the file when it is garbage
+    # collected and never frees the handle.
+    #
+    # https://www.mpg123.de/api/group__mpg123__init.shtml
+    #
+    def close(self):
+        if self.handle:
+            self._lib.mpg123_close(self.handle)
+            self._lib.mpg123_delete(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self.close()
 
     #
     # Open a mp3 media file
@@ -55,6 +148,48 @@ class ExtMpg123(mpg123.Mpg123):
         if errcode != mpg123.OK:
             raise self.OpenFileException(self.plain_strerror(errcode))
 
+    #
+    # Open a file to analyse rather than play it, decoding 16 bit samples.  If min_rate is given
+    # the channels are mixed down to mono and the rate down sampled as far as it can be without
+    # going below min_rate.  Returns the rate and channels decoded and the channels of the file.
+    #
+    def open_for_analysis(self, filename, min_rate=0):
+        self.set_output_format(mpg123.ENC_SIGNED_16)
+        self.open(filename)
+        rate, channels, _encoding = self.get_format()
+        file_channels = channels
+        if min_rate > 0:
+            try:
+                self.set_analysis_mode(ExtMpg123.down_sample_for(rate, min_rate))
+                self.open(filename)
+                rate, channels, _encoding = self.get_format()
+            except self.FormatException:
+                pass
+        return rate, channels, file_channels
+
+    #
+    # The largest mpg123 down sampling (0 = none, 1 = half rate, 2 = quarter rate) that keeps
+    # the rate at or above min_rate
+    #
+    @staticmethod
+    def down_sample_for(rate, min_rate):
+        for down_sample in [2, 1]:
+            if rate >> down_sample >= min_rate:
+                return down_sample
+        return 0
+
+    #
+    # Seek to a sample offset
+    #
+    # https://www.mpg123.de/api/group__mpg123__seek.shtml
+    #
+    def seek(self, sample, whence=SEEK_SET):
+        errcode = self._lib.mpg123_seek(self.handle, ctypes.c_long(sample), whence)
+        if errcode >= mpg123.OK:
+            return errcode
+        else:
+            raise self.LengthException(self.plain_strerror(errcode))
+
     #
     # Get the frame at the specified time offset
     #
@@ -81,6 +216,18 @@ class ExtMpg123(mpg123.Mpg123):
         else:
             raise self.LengthException(self.plain_strerror(errcode))
 
+    #
+    # Give the decoder the byte offset of every step'th frame, so that it can seek straight to
+    # any frame.  This needs to be set after the file is opened.
+    #
+    # https://www.mpg123.de/api/group__mpg123__seek.shtml
+    #
+    def set_index(self, offsets, step=1):
+        errcode = self._lib.mpg123_set_index(self.handle, offsets.ctypes.data_as(ctypes.POINTER(ctypes.c_long)),
+                                             ctypes.c_long(step), ctypes.c_size_t(len(offsets)))
+        if errcode != mpg123.OK:
+            raise self.LengthException(self.plain_strerror(errcode))
+
     #
     # Get the current frame number
     #
@@ -122,6 +269,126 @@ class ExtMpg123(mpg123.Mpg123):
         info = self.info()
         return ExtMpg123._samples_per_frame[info.version][info.layer - 1] * frame / info.rate
 
+    #
+    # The timing of the open file
+    #
+    def timing(self):
+        info = self.info()
+        return TrackTiming(info.rate, ExtMpg123._samples_per_frame[info.version][info.layer - 1], self.frame_length())
+
+    #
+    # Only allow the decoder to output the given encoding, at any of the MPEG sample rates
+    # and either mono or stereo.  This needs to be set before a file is opened.
+    #
+    # https://www.mpg123.de/api/group__mpg123__output.shtml
+    #
+    _rates = [8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000]
+
+    def set_output_format(self, encoding, force_rate=0):
+        self._lib.mpg123_format_none(self.handle)
+        rates = ExtMpg123._rates if force_rate in [0] + ExtMpg123._rates else ExtMpg123._rates + [force_rate]
+        for rate in rates:
+            errcode = self._lib.mpg123_format(
+                    self.handle, ctypes.c_long(rate), mpg123.MONO | mpg123.STEREO, encoding)
+            if errcode != mpg123.OK:
+                raise self.FormatException(self.plain_strerror(errcode))
+
+    #
+    # Set a decoder parameter
+    #
+    # https://www.mpg123.de/api/group__mpg123__init.shtml
+    #
+    def param(self, parameter, value, fvalue=0.0):
+        errcode = self._lib.mpg123_param(self.handle, parameter, ctypes.c_long(value), ctypes.c_double(fvalue))
+        if errcode != mpg123.OK:
+            raise self.FormatException(self.plain_strerror(errcode))
+
+    #
+    # Reduce the decoder output to what is needed for analysing the audio rather than playing
+    # it: the channels mixed down to mono and the rate reduced by 2 ** down_sample, or resampled
+    # to force_rate.  As with the output format this needs to be set before a file is opened.
+    #
+    def set_analysis_mode(self, down_sample=0, force_rate=0):
+        self.param(ExtMpg123.ADD_FLAGS, ExtMpg123.MONO_MIX)
+        if down_sample > 0:
+            self.param(ExtMpg123.DOWN_SAMPLE, down_sample)
+        if force_rate > 0:
+            self.param(ExtMpg123.FORCE_RATE, force_rate)
+
+    #
+    # Decode the file in blocks of up to block_size bytes of PCM, which is fewer calls
+    # than decoding frame by frame
+    #
+    # https://www.mpg123.de/api/group__mpg123__input.shtml
+    #
+    def iter_blocks(self, block_size, new_format_callback=None):
+        buffer = ctypes.create_string_buffer(block_size)
+        done = ctypes.c_size_t(0)
+
+        while True:
+            errcode = self._lib.mpg123_read(self.handle, buffer, ctypes.c_size_t(block_size), ctypes.pointer(done))
+            if done.value > 0:
+                yield buffer.raw[:done.value]
+            if errcode == mpg123.OK:
+                continue
+            if errcode == mpg123.NEW_FORMAT:
+                if new_format_callback:
+                    new_format_callback(*self.get_format())
+                continue
+            if errcode in (mpg123.NEED_MORE, mpg123.DONE):
+                break
+            raise self.DecodeException(self.plain_strerror(errcode))
+
+    #
+    # Decode the file into the same buffer each time, yielding the number of bytes decoded
+    # into it, so that no memory is allocated as the file is played.  The buffer is reused
+    # for the next block once the loop carries on.
+    #
+    def iter_into(self, buffer, new_format_callback=None):
+        size = ctypes.sizeof(buffer)
+        done = ctypes.c_size_t(0)
+        done_pointer = ctypes.byref(done)
+
+        while True:
+            errcode = self._lib.mpg123_read(self.handle, buffer, size, done_pointer)
+            if done.value > 0:
+                yield done.value
+            if errcode == mpg123.OK:
+                continue
+            if errcode == mpg123.NEW_FORMAT:
+                if new_format_callback:
+                    new_format_callback(*self.get_format())
+                continue
+            if errcode in (mpg123.NEED_MORE, mpg123.DONE):
+                break
+            raise self.DecodeException(self.plain_strerror(errcode))
+
+    #
+    # Decode up to size bytes into a buffer, returning the number of bytes decoded, which is
+    # less than size at the end of the file
+    #
+    def read_into(self, buffer, size):
+        filled = 0
+        done = ctypes.c_size_t(0)
+        while filled < size:
+            errcode = self._lib.mpg123_read(self.handle, ctypes.addressof(buffer) + filled, size - filled,
+                                            ctypes.byref(done))
+            filled += done.value
+            if errcode in (mpg123.OK, mpg123.NEW_FORMAT):
+                continue
+            if errcode in (mpg123.NEED_MORE, mpg123.DONE):
+                break
+            raise self.DecodeException(self.plain_strerror(errcode))
+        return filled
+
+    #
+    # The number of bytes in a sample of an encoding
+    #
+    # https://www.mpg123.de/api/group__mpg123__output.shtml
+    #
+    def encoding_size(self, encoding):
+        return self._lib.mpg123_encsize(encoding)
+
     #
     # Get the current volume
     #
@@ -157,11 +424,18 @@ class ExtMpg123(mpg123.Mpg123):
 # Add the required functions to Out123 to pause and resume the output
 #
 class ExtOut123(mpg123.Out123):
+    _FUNCTIONS = {
+        "out123_play": ([ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t], ctypes.c_size_t),
+        "out123_pause": ([ctypes.c_void_p], None),
+        "out123_continue": ([ctypes.c_void_p], None),
+    }
+
     def __init__(self, library_path=None):
         try:
             super().__init__(library_path)
         except mpg123.Out123.LibInitializationException:
             super().__init__("/opt/local/lib/libout123.dylib")
+        declare_functions(self._lib, ExtOut123._FUNCTIONS)
 
     #
     # Pause the current output
@@ -178,6 +452,14 @@ class ExtOut123(mpg123.Out123):
     def resume(self):
         self._lib.out123_continue(self.handle)
 
+    #
+    # Play the first size bytes of a buffer, without copying them
+    #
+    # https://www.mpg123.de/api/group__out123__api.shtml
+    #
+    def play_buffer(self, buffer, size):
+        return self._lib.out123_play(self.handle, buffer, size)
+
 
 #
 # Events generated by the player
@@ -192,6 +474,65 @@ class PlayerState(Enum):
     FINISHED = 6  # Finished
 
 
+#
+# Times the gaps between the frames written to the output.  The output blocks while its
+# buffer is full so the gaps are steady while playing, a long gap means the player thread
+# was held up and the output may have run dry.
+#
+# Also times the overhead of each frame, from the output of one frame returning to the
+# output of the next being started, which is the cost of decoding it and of the play loop.
+#
+class PlaybackTimer:
+    HISTORY = 2000
+
+    def __init__(self):
+        self.intervals = collections.deque(maxlen=PlaybackTimer.HISTORY)
+        self.overheads = collections.deque(maxlen=PlaybackTimer.HISTORY)
+        self._last = None
+
+    #
+    # Start timing again, the gap before the first frame isn't counted
+    #
+    def start(self):
+        self._last = None
+
+    #
+    # Called as a frame is about to be output
+    #
+    def output(self):
+        if self._last is not None:
+            self.overheads.append(time.perf_counter() - self._last)
+
+    #
+    # Called once a frame has been output
+    #
+    def tick(self):
+        now = time.perf_counter()
+        if self._last is not None:
+            self.intervals.append(now - self._last)
+        self._last = now
+
+    #
+    # The number, mean, maximum and 99th percentile of the recent gaps in seconds
+    #
+    def stats(self):
+        return PlaybackTimer._summary(self.intervals)
+
+    #
+    # The number, mean, maximum and 99th percentile of the recent overheads in seconds
+    #
+    def overhead_stats(self):
+        return PlaybackTimer._summary(self.overheads)
+
+    @staticmethod
+    def _summary(times):
+        times = sorted(times)
+        if len(times) == 0:
+            return 0, 0.0, 0.0, 0.0
+        p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+        return len(times), sum(times) / len(times), times[-1], p99
+
+
 #
 # A wrapper around mpg123 to handle the playback of files in a background thread
 #
@@ -204,12 +545,27 @@ class Player:
         LOAD = 1,
         PLAY = 2,
         PAUSE = 3,
-        SEEK = 5
+        SEEK = 5,
+        LOOP = 6
 
     class IllegalStateException(Exception):
         pass
 
-    def __init__(self):
+    #
+    # The size of the buffer the file is decoded into for playing, a frame of 16 bit stereo
+    # MPEG 1 layer III
+    #
+    PCM_BUFFER_BYTES = 1152 * 2 * 2
+
+    #
+    # The bytes of decoded segments kept around the current position for repeating them
+    #
+    PCM_RING_BYTES = 32 << 20
+
+    #
+    # The fingerprints of the files can be shared with the analysis
+    #
+    def __init__(self, fingerprints=None):
         self.mp3 = ExtMpg123()
         self.out = ExtOut123()
 
@@ -220,6 +576,38 @@ class Player:
         self.command_queue = queue.Queue(maxsize=1)
         self.event_queue = queue.Queue()
 
+        self.timer = PlaybackTimer()
+
+        #
+        # The frame indexes of the files that have been opened, and of the file that is loaded
+        #
+        self.frame_indexes = FrameIndexCache(fingerprints)
+        self.frame_index = None
+
+        #
+        # The timing of the loaded file, and the number of bytes in a frame of its decoded output
+        #
+        self.timing = None
+        self._frame_bytes = None
+
+        #
+        # The file is decoded into the same buffer which is then played from
+        #
+        self._pcm_buffer = ctypes.create_string_buffer(Player.PCM_BUFFER_BYTES)
+        self._silence = ctypes.create_string_buffer(Player.PCM_BUFFER_BYTES)
+        self._output_format = None
+
+        #
+        # The segments around the current position decoded ready to play
+        #
+        self.pcm_ring = PcmRing(Player.PCM_RING_BYTES, self._open_decoder)
+
+        #
+        # A handle with the next file already opened and scanned, ready to swap in on LOAD
+        #
+        self._preloaded = None
+        self._preload_lock = threading.Lock()
+
         self._current_state = PlayerState.INITALISED
         self.event_queue.put((self._current_state, None))
         threading.Thread(target=self._run_player, daemon=True, name="Player").start()
@@ -237,20 +625,46 @@ class Player:
                 if self._current_state in [PlayerState.PLAYING]:
                     self.out.pause()
 
-                self.mp3.open(command[1])
-                tf = self.mp3.frame_length()
-                self.track_length = self.mp3.frame_seconds(tf)
-                self.frames_per_second = tf // self.track_length
+                preloaded = self._take_preloaded(command[1])
+                #
+                # A file opened for the first time is indexed here, which scans its frame headers
+                # rather than decoding it to find its length, and the index is cached for next time
+                #
+                if preloaded is None:
+                    self.mp3.open(command[1])
+                    self.frame_index = self.frame_indexes.get_or_build(command[1])
+                    if self.frame_index is not None:
+                        self.mp3.set_index(self.frame_index.offsets)
+                        self.timing = TrackTiming.from_index(self.frame_index)
+                    else:
+                        self.timing = self.mp3.timing()
+                else:
+                    self.timing, self.frame_index = preloaded
+                self.track_length = self.timing.length
+                self.frames_per_second = self.timing.frames // self.track_length
                 self.update_per_frame_count = round(self.frames_per_second / 5)    # about 5 times a second
                 self.to_time = self.track_length
+                self.pcm_ring.load(command[1], self.frame_index, self.track_length)
                 self._set_state(PlayerState.LOADED, self.track_length)
                 self._set_state(PlayerState.READY, 0)
 
             elif command[0] == Player.Command.PLAY:
 
+                #
+                # Play a segment that has already been decoded from memory
+                #
+                segment = None
+                if command[1] is not None and command[2] is not None and \
+                        self._current_state in [PlayerState.READY, PlayerState.PLAYING, PlayerState.PAUSED]:
+                    segment = self.pcm_ring.get(command[1], command[2])
+                if segment is not None:
+                    if self._current_state in [PlayerState.PAUSED]:
+                        self.out.resume()
+                    self._play_pcm(segment, command[2])
+                    continue
+
                 if command[1] is not None:
-                    tf = self.mp3.timeframe(command[1])
-                    self.mp3.seek_frame(tf)
+                    self._seek_time(command[1])
                 self.to_time = self.track_length if command[2] is None else command[2]
 
                 if self._current_state in [PlayerState.READY, PlayerState.PLAYING]:
@@ -260,18 +674,28 @@ class Player:
                     self.out.resume()
                     self._play()
 
+            elif command[0] == Player.Command.LOOP:
+
+                #
+                # Decode the range once, if it isn't already, and play it over from memory
+                #
+                if self._current_state in [PlayerState.READY, PlayerState.PLAYING, PlayerState.PAUSED]:
+                    segment = self.pcm_ring.decode(command[1], command[2])
+                    if segment is not None:
+                        if self._current_state in [PlayerState.PAUSED]:
+                            self.out.resume()
+                        self._play_pcm(segment, command[2], command[3], command[4])
+
             elif command[0] == Player.Command.PAUSE:
                 self.out.pause()
-                current_frame = self.mp3.tellframe()
-                current_time = self.mp3.frame_seconds(current_frame)
+                current_time = self.timing.frame_seconds(self.mp3.tellframe())
                 self._set_state(PlayerState.PAUSED, current_time)
 
             elif command[0] == Player.Command.SEEK:
                 if self._current_state in \
                             [PlayerState.READY, PlayerState.PLAYING, PlayerState.PAUSED, PlayerState.FINISHED]:
 
-                    tf = self.mp3.timeframe(command[1])
-                    self.mp3.seek_frame(tf)
+                    self._seek_time(command[1])
                     if self._current_state == PlayerState.FINISHED:
                         self._set_state(PlayerState.PAUSED, command[1])
                     else:
@@ -284,37 +708,56 @@ class Player:
                 # what happened?
                 pass
 
+    #
+    # Seek to a time in seconds.  With a frame index the decoder goes straight to the frame and
+    # decodes from there to the sample, otherwise it finds the frame as best it can.
+    #
+    def _seek_time(self, tsec):
+        self.pcm_ring.move_to(tsec)
+        if self.frame_index is not None:
+            self.mp3.seek(int(round(tsec * self.frame_index.sample_rate)))
+        else:
+            self.mp3.seek_frame(self.timing.timeframe(tsec))
+
     #
     # The play loop, process the mp3 file, checking for any commands.  If there are any let let _run_player handle it
     #
     def _play(self):
-        fc = self.mp3.tellframe()
-        current_time = self.mp3.frame_seconds(fc)
+        start_frame = self.mp3.tellframe()
+        current_time = self.timing.frame_seconds(start_frame)
         self._set_state(PlayerState.PLAYING, current_time)
 
         #
         # work out the end frame.  The to time will be in the returned frame so
         # want to stop at before the next one.
-        to_frame = self.mp3.timeframe(self.to_time) + 1
+        to_frame = self.timing.timeframe(self.to_time) + 1
 
-        for frame in self.mp3.iter_frames(self.out.start):
+        played = 0
+        next_update = start_frame + self.update_per_frame_count
+        self.timer.start()
+        for done in self.mp3.iter_into(self._pcm_buffer, self._new_format):
             #
-            # output the frame
+            # output the decoded block from the buffer
             #
-            self.out.play(frame)
+            self.timer.output()
+            self.out.play_buffer(self._pcm_buffer, done)
+            self.timer.tick()
 
             #
             # Check if the end frame has been reached otherwise
-            # update the current track time about four times per second
+            # update the current track time about four times per second.
+            # The bytes played are counted so the time doesn't need to be asked for.
             #
-            fc += 1
+            played += done
+            fc = start_frame + played // self._frame_bytes
             if fc > to_frame:
-                current_time = self.mp3.frame_seconds(self.mp3.tellframe())
-                self._set_state(PlayerState.PAUSED, current_time)
+                self._set_state(PlayerState.PAUSED, self.timing.frame_seconds(fc))
                 return
 
-            if fc % self.update_per_frame_count == 0:
-                current_time = self.mp3.frame_seconds(self.mp3.tellframe())
+            if fc >= next_update:
+                next_update = fc + self.update_per_frame_count
+                current_time = self.timing.frame_seconds(fc)
+                self.pcm_ring.move_to(current_time)
                 self.event_queue.put((PlayerState.PLAYING, current_time))
 
             if not self.command_queue.empty():
@@ -324,6 +767,134 @@ class Player:
         #
         self._set_state(PlayerState.FINISHED)
 
+    #
+    # Play a decoded segment from memory up to to_time, repetitions times or until there is
+    # another command if repetitions is None, with gap seconds of silence between them.  The
+    # decoder is left at the time it stopped so that playing can carry on from there.  If the
+    # volume is changed while playing, the segment is decoded again at the new volume.
+    #
+    def _play_pcm(self, segment, to_time, repetitions=1, gap=0.0):
+        if self._output_format != segment.format:
+            self.out.start(*segment.format)
+            self._output_format = segment.format
+
+        end = segment.offset(to_time)
+        gap_bytes = int(gap * segment.rate) * segment.sample_bytes
+        played = end
+        repetition = 0
+        self.timer.start()
+        while repetitions is None or repetition < repetitions:
+            if repetition > 0 and not self._output_silence(gap_bytes):
+                break
+            self._set_state(PlayerState.PLAYING, segment.start)
+            played = self._output_pcm(segment, 0, end)
+            while played < end and segment.volume != self.pcm_ring.volume:
+                redecoded = self.pcm_ring.decode(segment.start, segment.end)
+                if redecoded is None:
+                    break
+                segment = redecoded
+                played = self._output_pcm(segment, played, end)
+            if played < end:
+                break
+            repetition += 1
+
+        #
+        # Played to the end so report the end time asked for, which is the start of the next
+        # segment, rather than a time rounded to a sample before it
+        #
+        if played >= end:
+            current_time = max(segment.time_at(played), min(to_time, segment.end))
+        else:
+            current_time = segment.time_at(played)
+        self._seek_time(current_time)
+        if self.command_queue.empty():
+            self._set_state(PlayerState.PAUSED, current_time)
+
+    #
+    # Output the segment from the played offset up to the end offset, returning the offset it got
+    # to, which is short of the end if there is another command or the volume has changed
+    #
+    def _output_pcm(self, segment, played, end):
+        update_bytes = self.timing.samples_per_frame * segment.sample_bytes * self.update_per_frame_count
+        next_update = played + update_bytes
+        while played < end and segment.volume == self.pcm_ring.volume:
+            size = min(Player.PCM_BUFFER_BYTES, end - played)
+            self.timer.output()
+            self.out.play_buffer(segment.address(played), size)
+            self.timer.tick()
+            played += size
+
+            if played >= next_update:
+                next_update = played + update_bytes
+                self.event_queue.put((PlayerState.PLAYING, segment.time_at(played)))
+
+            if not self.command_queue.empty():
+                break
+        return played
+
+    #
+    # Output size bytes of silence, returning False if there is another command first
+    #
+    def _output_silence(self, size):
+        while size > 0:
+            if not self.command_queue.empty():
+                return False
+            self.out.play_buffer(self._silence, min(Player.PCM_BUFFER_BYTES, size))
+            size -= Player.PCM_BUFFER_BYTES
+        return True
+
+    #
+    # The decoder has found the format of the file, start the output with it
+    #
+    def _new_format(self, rate, channels, encoding):
+        self._frame_bytes = self.timing.samples_per_frame * channels * self.mp3.encoding_size(encoding)
+        self.out.start(rate, channels, encoding)
+        self._output_format = (rate, channels, encoding)
+
+    #
+    # Open a decoder on a file, giving it the frame index if there is one
+    #
+    @staticmethod
+    def _open_decoder(filename, frame_index):
+        mp3 = ExtMpg123()
+        mp3.open(filename)
+        if frame_index is not None:
+            mp3.set_index(frame_index.offsets)
+        return mp3
+
+    #
+    # Open and scan the next file on another thread so that loading it later is quick.  The
+    # frame index is built and cached if it hasn't been already.
+    #
+    def _preload(self, filename):
+        try:
+            frame_index = self.frame_indexes.get_or_build(filename)
+            mp3 = self._open_decoder(filename, frame_index)
+            if frame_index is not None:
+                timing = TrackTiming.from_index(frame_index)
+            else:
+                timing = mp3.timing()
+        except (mpg123.Mpg123.OpenFileException, mpg123.Mpg123.LengthException, mpg123.Mpg123.NeedMoreException,
+                mpg123.Mpg123.ID3Exception):
+            return
+        with self._preload_lock:
+            self._preloaded = (filename, mp3, timing, frame_index)
+
+    #
+    # Swap in the preloaded handle if it is for the file, keeping the volume.  Returns the
+    # timing and frame index of the file or None if it wasn't preloaded.
+    #
+    def _take_preloaded(self, filename):
+        with self._preload_lock:
+            preloaded = self._preloaded
+            self._preloaded = None
+        if preloaded is None or preloaded[0] != filename:
+            return None
+        _filename, mp3, timing, frame_index = preloaded
+        mp3.set_volume(self.mp3.get_volume()[0])
+        self.mp3 = mp3
+        return timing, frame_index
+
     #
     # update the player state and put the event in the queue
     #
@@ -348,6 +919,23 @@ class Player:
     def seek(self, tsec):
         self.command_queue.put((Player.Command.SEEK, tsec))
 
+    #
+    # Play from from_time to to_time repetitions times, or until there is another command if
+    # repetitions is None, with gap seconds between them
+    #
+    def loop(self, from_time, to_time, repetitions=None, gap=0.0):
+        self.command_queue.put((Player.Command.LOOP, from_time, to_time, repetitions, gap))
+
+    #
+    # The segments of a file, those around the current position are decoded ahead once it is
+    # loaded.  The file name is given as the segments may arrive before the file is loaded.
+    #
+    def set_segments(self, segments, file_name=None):
+        self.pcm_ring.set_segments(segments, file_name)
+
+    def preload(self, filename):
+        threading.Thread(target=self._preload, args=(filename,), daemon=True, name="PlayerPreload").start()
+
     #
     # Set/get the volume.
     #
@@ -356,6 +944,20 @@ class Player:
 
     def set_volume(self, volume):
         self.mp3.set_volume(volume)
+        self.pcm_ring.set_volume(volume)
+
+    #
+    # The count, mean, maximum and 99th percentile of the gaps between output frames
+    #
+    def jitter(self):
+        return self.timer.stats()
+
+    #
+    # The count, mean, maximum and 99th percentile of the time spent decoding and in the play
+    # loop for each frame
+    #
+    def overhead(self):
+        return self.timer.overhead_stats()
 
 #
 #
@@ -363,8 +965,6 @@ class Player:
 
 
 if __name__ == "__main__":
-    import time
-
     p = Player()
 
     def monitor():
@@ -383,3 +983,5 @@ if __name__ == "__main__":
 
     p.play(None, 145)
     time.sleep(100)
+    print("Frame gaps: {} mean {:.4f}s max {:.4f}s p99 {:.4f}s".format(*p.jitter()))
+    print("Frame overhead: {} mean {:.6f}s max {:.6f}s p99 {:.6f}s".format(*p.overhead()))
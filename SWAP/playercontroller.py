@@ -2,7 +2,9 @@
 #
 #
 import os
+import re
 import sys
+import threading
 from tkinter import filedialog
 import tkinter as tk
 import eyed3
@@ -12,9 +14,28 @@ from SWAP.playermodel import PlayerModel
 from SWAP.settingsmanager import SettingsManager
 from SWAP.player import Player, PlayerState
 from SWAP.segmentsanalyzer import SegmentsAnalyzer
+from SWAP.memorycache import MemoryCache
+from SWAP.fingerprintindex import FingerprintIndex
 
 
 class PlayerController:
+    #
+    # The number of files after the current one that are analysed ahead of time
+    #
+    PREFETCH_FILES = 2
+
+    #
+    # The bytes of tags kept in memory for the files that have been opened or are likely to be next
+    #
+    TAG_CACHE_BYTES = 1 << 20
+
+    #
+    # How many times a segment is looped, None until another control is used, and the seconds
+    # of silence between the repetitions
+    #
+    LOOP_REPETITIONS = None
+    LOOP_GAP = 0.5
+
     def __init__(self, rw):
         self.root = rw
         self.root.protocol('WM_DELETE_WINDOW', self.quit)
@@ -34,6 +55,7 @@ class PlayerController:
         self.model.recent_files.add_callback(self.view.set_menu_recents)
 
         self.model.segments.add_callback(self.vu_segments)
+        self.model.segments_changed.add_callback(self.vu_segments_changed)
         self.model.load_progress.add_callback(self.vu_load_progress)
         self.model.volume.add_callback(self.vu_volume)
         self.model.muted.add_callback(self.vu_muted)
@@ -58,9 +80,11 @@ class PlayerController:
         self.view.menu_recents_callback = self.menu_recent_selected
 
         #
-        # Create the media player and get the current volume level
+        # Create the media player and get the current volume level.  The player and the analyzer
+        # share the fingerprints of the files.
         #
-        self.player = Player()
+        self.fingerprints = FingerprintIndex()
+        self.player = Player(self.fingerprints)
         self.model.volume.set(self.player.get_volume()[0])
         self.model.file_name.add_callback(self.player.open)
 
@@ -77,18 +101,29 @@ class PlayerController:
         self.view.master.bind("<Command-Left>", lambda i=-10: self.prev_pressed(i))
         self.view.master.bind("r", self.repeat_pressed)
         self.view.master.bind("R", self.repeat_pressed)
+        self.view.master.bind("l", self.loop_pressed)
+        self.view.master.bind("L", self.loop_pressed)
         self.view.master.bind("s", self.step_pressed)
         self.view.master.bind("S", self.step_pressed)
         self.view.master.bind("<space>", self.play_pause_pressed)
         self.view.master.bind("<Right>", lambda i=1: self.next_pressed(i))
         self.view.master.bind("<Command-Right>", lambda i=10: self.next_pressed(i))
 
-        self.segment_analyzer = SegmentsAnalyzer()
+        #
+        # Analyse the files in a separate process so that playback isn't held up by it
+        #
+        self.segment_analyzer = SegmentsAnalyzer(out_of_process=True, fingerprints=self.fingerprints)
         self.segment_analyzer.progress_callback = self.model.load_progress.set
+        self.segment_analyzer.segments_callback = self.model.add_segments
         self.segment_analyzer.completed_callback = self.model.set_segments
         self.model.gap_analysis.add_callback(self.segment_analyzer.set_analyzer_profile)
         self.model.gap_analysis.add_callback(self.view.set_gap_analysis)
 
+        #
+        # The album and title of the files that have been opened or are likely to be next
+        #
+        self.tag_cache = MemoryCache(PlayerController.TAG_CACHE_BYTES)
+
         #
         # Load the settings, i.e. recents
         #
@@ -159,6 +194,15 @@ class PlayerController:
     #
     def vu_segments(self, segments):
         self.view.set_segments(segments)
+        self.player.set_segments(segments, self.model.file_name.get())
+        self.player_state_button(None)
+
+    #
+    # Segments have been added while the file is being analysed
+    #
+    def vu_segments_changed(self, change):
+        self.view.update_segments(*change)
+        self.player.set_segments(self.model.segments.get(), self.model.file_name.get())
         self.player_state_button(None)
 
     def player_state_button(self, _x):
@@ -263,6 +307,24 @@ class PlayerController:
             target_segment_end_time = self.model.segments.get()[target_segment + 1] + 0.00000000001
             self.player.play(target_segment_start_time, target_segment_end_time)
 
+    #
+    # Loop the current segment if playing otherwise the previous one, as for repeat, until
+    # another control is used
+    #
+    def loop_pressed(self, _event=None):
+        segments = self.model.segments.get()
+        current_segment = self.model.current_segment.get()
+        if current_segment is None or len(segments) == 0:
+            return
+        if self.model.player_state.get() != PlayerState.PLAYING:
+            current_segment = max(0, current_segment - 1)
+        if current_segment < len(segments) - 1:
+            end_time = segments[current_segment + 1] + 0.00000000001
+        else:
+            end_time = self.model.track_length.get()
+        self.player.loop(segments[current_segment], end_time, PlayerController.LOOP_REPETITIONS,
+                         PlayerController.LOOP_GAP)
+
     #
     #
     #
@@ -356,6 +418,11 @@ class PlayerController:
         if menu_item == "menuFileOpen":
             self.menu_open_file()
 
+        elif menu_item == "menuFileOpenNext":
+            next_files = self.next_files(self.model.file_name.get(), 1)
+            if len(next_files) > 0:
+                self.open_file(next_files[0])
+
         elif menu_item == "menuFileQuit":
             self.quit()
 
@@ -426,23 +493,74 @@ class PlayerController:
         # Get the mp3 tags
         #
         self.model.segments.set([])
-        audiofile = eyed3.load(file_name)
-        if audiofile.tag is None:
-            self.model.album.set("Unknown")
-            self.model.title.set("Unknown")
-        else:
-            self.model.album.set(audiofile.tag.album or "Unknown")
-            if audiofile.tag.track_num[0]:
-                self.model.title.set("{} : {}".format(audiofile.tag.track_num[0], audiofile.tag.title or "Unknown"))
-            else:
-                self.model.title.set(audiofile.tag.title or "Unknown")
+        album, title = self.read_tags(file_name)
+        self.model.album.set(album)
+        self.model.title.set(title)
 
-            #
-            # Get the segments
-            #
+        #
+        # Get the segments
+        #
         self.segment_analyzer.process(file_name)
+
+        #
+        # Get the next files ready while this one is playing
+        #
+        next_files = self.next_files(file_name, PlayerController.PREFETCH_FILES)
+        self.segment_analyzer.prefetch(next_files)
+        if len(next_files) > 0:
+            self.player.preload(next_files[0])
+            threading.Thread(target=lambda: [self.read_tags(f) for f in next_files],
+                             daemon=True, name="TagPrefetch").start()
         return True
 
+    #
+    # The album and title from the mp3 tags, remembered for when the file is opened again
+    #
+    def read_tags(self, file_name):
+        tags = self.tag_cache.get(file_name)
+        if tags is not None:
+            return tags
+
+        album = "Unknown"
+        title = "Unknown"
+        audiofile = eyed3.load(file_name)
+        if audiofile is not None and audiofile.tag is not None:
+            album = audiofile.tag.album or "Unknown"
+            if audiofile.tag.track_num[0]:
+                title = "{} : {}".format(audiofile.tag.track_num[0], audiofile.tag.title or "Unknown")
+            else:
+                title = audiofile.tag.title or "Unknown"
+        self.tag_cache.put(file_name, (album, title))
+        return album, title
+
+    #
+    # The files likely to be opened after this one, the following files in the same directory
+    # in number order or, at the end of the directory, the next recent files
+    #
+    def next_files(self, file_name, count):
+        if not file_name:
+            return []
+        directory = os.path.dirname(os.path.abspath(file_name))
+        extension = os.path.splitext(file_name)[1].lower()
+        try:
+            siblings = [f for f in os.listdir(directory) if os.path.splitext(f)[1].lower() == extension]
+        except OSError:
+            siblings = []
+        siblings.sort(key=PlayerController._natural_key)
+        name_key = PlayerController._natural_key(os.path.basename(file_name))
+        following = [os.path.join(directory, f) for f in siblings if PlayerController._natural_key(f) > name_key]
+        if len(following) == 0:
+            following = [f for f in self.model.recent_files.get() if f != file_name and os.path.exists(f)]
+        return following[:count]
+
+    #
+    # Sort "Lesson 2" before "Lesson 10"
+    #
+    @staticmethod
+    def _natural_key(name):
+        return [(0, int(part), "") if part.isdigit() else (1, 0, part.lower())
+                for part in re.split(r"(\d+)", name)]
+
     #
     #
     #
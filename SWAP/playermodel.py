@@ -3,6 +3,7 @@
 
 """
 
+import bisect
 from SWAP.observable import Observable
 from SWAP.player import PlayerState
 
@@ -17,6 +18,10 @@ class PlayerModel:
         self.album = Observable("")
         self.title = Observable("")
         self.segments = Observable([])
+        #
+        # Changes made to the segments in place, as (index, number removed, segments inserted)
+        #
+        self.segments_changed = Observable(None)
         self.track_length = Observable(0.0)
 
         self.load_progress = Observable(0)
@@ -71,7 +76,21 @@ class PlayerModel:
         self.current_segment.set(ix)
 
     def set_segments(self, segments):
-        self.segments.set(segments)
+        self.segments.set(list(segments))
+        self.set_current_position(self.current_position.get())
+
+    #
+    # Add the segments found between from_time and to_time, replacing any provisional segments
+    # already in that range, without rebuilding the whole list
+    #
+    def add_segments(self, segments, from_time, to_time):
+        current = self.segments.get()
+        lo = bisect.bisect_left(current, from_time)
+        hi = bisect.bisect_left(current, to_time)
+        if hi == lo and len(segments) == 0:
+            return
+        current[lo:hi] = segments
+        self.segments_changed.notify((lo, hi - lo, segments))
         self.set_current_position(self.current_position.get())
 
 if __name__ == "__main__":
@@ -57,6 +57,9 @@ class PlayerView(tk.Frame):
         self.file_menu.add_command(
             label="Open", accelerator="Command+O",
             command=lambda i="menuFileOpen": self._menu_callback(i))
+        self.file_menu.add_command(
+            label="Open next",
+            command=lambda i="menuFileOpenNext": self._menu_callback(i))
         self.menu_recents = tk.Menu(self.file_menu)
         self.menu_recents.add_separator()
         self.menu_recents.add_command(
@@ -298,6 +301,15 @@ class PlayerView(tk.Frame):
         self.segment_list.selection_clear(0, tk.END)
         self.segment_list.selection_set(0)
 
+    #
+    # Replace count segments from index with the inserted ones, leaving the rest of the list alone
+    #
+    def update_segments(self, index, count, inserted):
+        if count > 0:
+            self.segment_list.delete(index, index + count - 1)
+        if len(inserted) > 0:
+            self.segment_list.insert(index, *[PlayerView._display_time(i) for i in inserted])
+
     ################################################################################################################
     #
     # update the recents menu with the first X most recent files if there are any available.
@@ -7,192 +7,820 @@ Based on https://gist.github.com/rudolfbyker/8fc0d99ecadad0204813d97fee2c6c06
 """
 
 import os
+import itertools
 import threading
-import queue
+import time
+import concurrent.futures
+import multiprocessing
 
-from scipy.io import wavfile
 import numpy as np
 from pydub import AudioSegment
 from SWAP.mediacache import MediaCache
-import pickle
+from SWAP.memorycache import MemoryCache
+from SWAP.fingerprintindex import FingerprintIndex
+from SWAP.segmentstore import SegmentStore
+from SWAP.pcmfile import PcmFile
+from SWAP.energyenvelope import EnergyEnvelope, EnvelopeFile
+from SWAP.mp3frames import Mp3Frames
+from SWAP.frameindex import FrameIndexCache
+from SWAP import parallelenvelope
+from SWAP.analyzerprocess import AnalyzerProcess
+from SWAP.analysisscheduler import AnalysisScheduler, AnalysisJob
+from SWAP.player import ExtMpg123
+import mpg123
 
 
 class AnalyzerProfile:
-    def __init__(self, name, window_duration, silence_threshold, step_duration):
+    def __init__(self, name, window_duration, silence_threshold, step_duration, min_sample_rate=11025):
         self.name = name
         self.window_duration = window_duration
         self.silence_threshold = silence_threshold
         self.step_duration = step_duration
+        #
+        # The lowest sample rate the audio can be decoded at and still give a reliable envelope
+        #
+        self.min_sample_rate = min_sample_rate
 
     def __str__(self):
         return self.name
 
 
+#
+# Find the segments of an analyzer profile from an envelope at the base resolution, as it
+# is fed in.  The profile windows are made up of whole envelope blocks.
+#
+# The profile windows find where the speech starts to within a step.  If refine is set,
+# the envelope around each of these is then searched for its quietest point, which becomes
+# the start of the segment, so that the boundaries are accurate to a few blocks.
+#
+class SegmentDetector:
+    #
+    # The length of the quiet spot searched for when refining a boundary
+    #
+    REFINE_WINDOW_DURATION = 0.03
+
+    def __init__(self, profile, sample_rate, block_size, refine=True):
+        self.block_duration = block_size / float(sample_rate)
+        self.window_blocks = max(1, int(round(profile.window_duration / self.block_duration)))
+        self.step_blocks = max(1, int(round(profile.step_duration / self.block_duration)))
+        self.step_duration = self.step_blocks * self.block_duration
+        self.silence_threshold = profile.silence_threshold
+        self.refine = refine
+        self.segments = []
+        self._windows = EnergyEnvelope(self.window_blocks, self.step_blocks, squares=False, dtype=np.float64)
+        self._previous_sound = False
+
+        #
+        # The part of the envelope that the next boundary could be refined in, and the
+        # index of its first block
+        #
+        self._refine_blocks = max(1, int(round(SegmentDetector.REFINE_WINDOW_DURATION / self.block_duration)))
+        self._recent = np.zeros(0, dtype=np.float32)
+        self._recent_start = 0
+
+    def feed(self, envelope):
+        if self.refine:
+            self._recent = np.concatenate((self._recent, np.asarray(envelope, dtype=np.float32)))
+
+        window_count = self._windows.windows
+        window_sound = self._windows.feed(envelope) > self.silence_threshold
+        rising, self._previous_sound = SegmentsAnalyzer._rising_edges_from(window_sound, self._previous_sound)
+        for r in rising:
+            self.segments.append(self._boundary(window_count + int(r)))
+
+        #
+        # Only keep the envelope from the window before the next one to be found
+        #
+        if self.refine:
+            keep_from = max(0, (self._windows.windows - 1) * self.step_blocks)
+            if keep_from > self._recent_start:
+                self._recent = self._recent[keep_from - self._recent_start:]
+                self._recent_start = keep_from
+
+    #
+    # The start of the segment where the sound rises above the threshold in window index.  The
+    # fine search covers the quiet window before it and the window itself, taking the last of
+    # the quietest spots so that the segment starts close to the speech.
+    #
+    def _boundary(self, index):
+        coarse = index * self.step_duration
+        if not self.refine or index == 0:
+            return coarse
+
+        lo = (index - 1) * self.step_blocks
+        hi = index * self.step_blocks + self.window_blocks
+        neighbourhood = self._recent[lo - self._recent_start:hi - self._recent_start]
+        if len(neighbourhood) < self._refine_blocks:
+            return coarse
+        quiet = np.convolve(neighbourhood, np.ones(self._refine_blocks) / self._refine_blocks, mode="valid")
+        quietest = len(quiet) - 1 - int(np.argmin(quiet[::-1]))
+        boundary = (lo + quietest + self._refine_blocks // 2) * self.block_duration
+
+        #
+        # Keep the segments in order where the neighbourhoods overlap
+        #
+        if len(self.segments) > 0 and boundary <= self.segments[-1]:
+            boundary = self.segments[-1] + self.block_duration
+        return boundary
+
+    #
+    # The time up to which the segments have been found, i.e. the earliest time that a segment
+    # still to be found can start at.  A refined boundary can be anywhere from the start of the
+    # window before the one where the sound rises, and always comes after the last segment.
+    #
+    def analysed_to(self):
+        analysed_to = max(0, self._windows.windows - 1) * self.step_duration
+        if len(self.segments) > 0:
+            analysed_to = max(analysed_to, self.segments[-1] + self.block_duration)
+        return analysed_to
+
+    #
+    # Add the frame for the end of the file and return all of the segments
+    #
+    def finish(self):
+        self.segments.append(self._windows.windows * self.step_duration)
+        return self.segments
+
+
 class SegmentsAnalyzer:
     SHORT = 'short'
     STANDARD = 'standard'
     LONG = 'long'
 
-    def __init__(self):
+    #
+    # The typical energy of a window of speech, the quick analysis silence threshold is set
+    # this far below the loud parts of the file
+    #
+    QUICK_SPEECH_ENERGY = 1e-2
+
+    #
+    # The duration of each value of the envelope that is cached for a file, all of the
+    # profiles are worked out from this
+    #
+    ENVELOPE_BLOCK_DURATION = 0.01
+    ENVELOPE_KEY = "envelope"
+
+    #
+    # The envelope of a file is saved as it is worked out so that the analysis can carry on
+    # from there if it is stopped.  The saved envelope is fed back in this many blocks at a time.
+    #
+    CHECKPOINT_KEY = "envelope.part"
+    ANALYSIS_LOCK_KEY = "analysis"
+    CHECKPOINT_FEED_BLOCKS = 1 << 16
+
+    #
+    # The length of file worth splitting across the workers and into how many chunks, the
+    # minimum seconds between incremental batches of segments and the share of the progress
+    # bar given to converting a file to WAV.  The size of the blocks of samples that are
+    # analysed between checks for abandoning the analysis is parallelenvelope.DECODE_BLOCK_BYTES.
+    #
+    PARALLEL_MIN_DURATION = 600.0
+    PARALLEL_CHUNKS_PER_WORKER = 2
+    SEGMENTS_BATCH_INTERVAL = 0.5
+    WAVE_CONVERT_PROGRESS = 20.0
+    PCM_KEY = "pcm"
+
+    #
+    # The bytes of segments and envelopes kept in memory in front of the caches on disk
+    #
+    MEMORY_CACHE_BYTES = 64 << 20
+
+    #
+    # If out_of_process is set the files are analysed by a worker process rather than by
+    # analysis_workers threads in this process.  The fingerprints of the files can be shared
+    # with the player.
+    #
+    def __init__(self, out_of_process=False, analysis_workers=2, fingerprints=None):
 
         self.analyzer_profiles = {
-            SegmentsAnalyzer.SHORT:  AnalyzerProfile(SegmentsAnalyzer.SHORT, 0.15, 1e-5,  0.15),
-            SegmentsAnalyzer.STANDARD: AnalyzerProfile(SegmentsAnalyzer.STANDARD, 0.4, 1e-6,  0.3),
-            SegmentsAnalyzer.LONG: AnalyzerProfile(SegmentsAnalyzer.LONG, 0.5, 1e-6,  0.2)
+            SegmentsAnalyzer.SHORT:  AnalyzerProfile(SegmentsAnalyzer.SHORT, 0.15, 1e-5,  0.15, 16000),
+            SegmentsAnalyzer.STANDARD: AnalyzerProfile(SegmentsAnalyzer.STANDARD, 0.4, 1e-6,  0.3, 11025),
+            SegmentsAnalyzer.LONG: AnalyzerProfile(SegmentsAnalyzer.LONG, 0.5, 1e-6,  0.2, 11025)
         }
         self.analyzer_profile = self.analyzer_profiles[SegmentsAnalyzer.STANDARD]
 
+        #
+        # Decode MP3 files mixed down to mono and at the lowest rate the profile allows
+        #
+        self.reduced_decode = True
+
+        #
+        # Compress the samples of files converted for analysis
+        #
+        self.compress_pcm = True
+
+        #
+        # Publish provisional segments estimated from the MP3 frames before decoding the file
+        #
+        self.quick_analysis = True
+
+        #
+        # Analyse in incremental mode, handing the segments over in batches to
+        # segments_callback(segments, from_time, to_time) as the file is analysed, where the
+        # segments are those found between from_time and to_time
+        #
+        self.incremental = True
+
+        #
+        # Refine the segment boundaries to the quietest point around them
+        #
+        self.refine_boundaries = True
+
+        #
+        # The number of processes used to work out the envelope of a long file
+        #
+        self.workers = max(1, (os.cpu_count() or 1) - 1)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        #
+        # failed_callback(file_name, message) is called if the analysis of the file that has
+        # been opened fails, after the progress has been reset
+        #
         self.progress_callback = None
+        self.segments_callback = None
         self.completed_callback = None
-        self.wave_cache = MediaCache("wav")
-        self.segments_cache = MediaCache("seg")
-
-        self._abandon_processing = threading.Event()
-        self._queue = queue.Queue()
-        self._thread = threading.Thread(
-                target=self._process_queue,
-                args=(self._queue, self._abandon_processing),
-                daemon=True,
-                name="SegmentsAnalyzer")
-        self._thread.start()
+        self.failed_callback = None
+
+        #
+        # The tag of the request that the callbacks are being called for in each thread
+        #
+        self._request = threading.local()
+
+        #
+        # The caches are opened by the worker process when there is one, not here as well
+        #
+        self.fingerprints = fingerprints
+        self.pcm_cache = None
+        self.segment_store = None
+        self.envelope_cache = None
+        self.memory_cache = None
+        self.frame_indexes = None
+
+        self._analyzer_process = None
+        self.scheduler = None
+        if out_of_process:
+            self._analyzer_process = AnalyzerProcess(self)
+            return
+
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintIndex()
+        self.pcm_cache = MediaCache("pcm")
+        self.segment_store = SegmentStore()
+        self.envelope_cache = MediaCache("env")
+        self.memory_cache = MemoryCache(SegmentsAnalyzer.MEMORY_CACHE_BYTES)
+        self.frame_indexes = FrameIndexCache(self.fingerprints)
+        self.scheduler = AnalysisScheduler(self._run_job, analysis_workers, name="SegmentsAnalyzer")
 
     def set_analyzer_profile(self, analyzer_profile):
         if analyzer_profile in self.analyzer_profiles:
             self.analyzer_profile = self.analyzer_profiles[analyzer_profile]
 
-    def process(self, media_file):
+    #
+    # Analyse the file that has been opened, reporting it to the callbacks.  The tag identifies
+    # the request to the callbacks, through request_tag().
+    #
+    def process(self, media_file, tag=None):
+        if self._analyzer_process is not None:
+            self._analyzer_process.process(media_file, self.analyzer_profile.name)
+            return
+
         #
-        # Tell the SegmentsAnalyzer daemon to stop what ever it may currently be processing,
-        # then queue the this item
+        # Stop analysing the previous foreground file, then queue this one
         #
-        self._abandon_processing.set()
+        self.scheduler.cancel(AnalysisJob.FOREGROUND)
+        profile = self.analyzer_profile
+        self._request.tag = tag
 
         #
         # if the segments exist in the cache, then use them
         #
-        seg_file = os.path.join(media_file, self.analyzer_profile.name)
-        if self.segments_cache.is_file_in_cache(seg_file):
-            cfn = self.segments_cache.get_file_cache_name(seg_file)
-            segments = pickle.load(open(cfn, "rb"))
-            if self.progress_callback is not None:
-                self.progress_callback(0.0)
-            if self.completed_callback is not None:
-                self.completed_callback(segments)
+        segments = self._cached_segments(media_file, profile)
+        if segments is not None:
+            self._publish_segments(segments)
+            return
+
+        #
+        # if the envelope of the file has been cached, the segments can be worked out from it
+        # without going back to the audio
+        #
+        segments = self._segments_from_cached_envelope(media_file, profile)
+        if segments is not None:
+            self._store_segments(media_file, profile, segments)
+            self._publish_segments(segments)
             return
 
         #
         # The file isn't in the cache, so will need to process the mp3 to create it
         #
-        self._queue.put(media_file)
+        self.scheduler.submit(media_file, profile, AnalysisJob.FOREGROUND, tag)
+
+    #
+    # The tag passed to process() for the file that the callbacks are being called about
+    #
+    def request_tag(self):
+        return getattr(self._request, "tag", None)
+
+    #
+    # Analyse the files that are likely to be opened next in the background so that their
+    # segments are cached by then.  Replaces the files from the last call.
+    #
+    def prefetch(self, media_files):
+        if self._analyzer_process is not None:
+            self._analyzer_process.prefetch(media_files, self.analyzer_profile.name)
+            return
+
+        profile = self.analyzer_profile
+        self.scheduler.cancel(AnalysisJob.PREFETCH, keep=media_files)
+        for media_file in media_files:
+            if not self.segments_cached(media_file, profile) and not self.scheduler.is_scheduled(media_file, profile):
+                self.scheduler.submit(media_file, profile, AnalysisJob.PREFETCH)
+
+    #
+    # Analyse a file for each of the profiles in the calling thread, storing the envelope and
+    # the segments in the caches.  Profiles whose segments are already cached are skipped.
+    # Returns the duration of the file in seconds, or None if it isn't known.
+    #
+    def analyze(self, media_file, profiles):
+        abandon = threading.Event()
+        for profile in profiles:
+            if self.segments_cached(media_file, profile):
+                continue
+            segments = self._segments_from_cached_envelope(media_file, profile)
+            if segments is None:
+                self._compute_segments(media_file, profile, abandon)
+            else:
+                self._store_segments(media_file, profile, segments)
+        return self.cached_duration(media_file)
+
+    #
+    # Whether the segments of the file for the profile are in the cache
+    #
+    def segments_cached(self, media_file, profile):
+        try:
+            key = self._cache_key(media_file, profile.name)
+            if self.memory_cache.get(("segments", key, self.refine_boundaries)) is not None:
+                return True
+            return self.segment_store.contains(self._cache_key(media_file, profile.name), profile,
+                                               self.refine_boundaries)
+        except OSError:
+            return False
+
+    #
+    # The duration of the file in seconds from its cached envelope, or None if it isn't cached
+    #
+    def cached_duration(self, media_file):
+        cached = self._cached_envelope(media_file)
+        if cached is None:
+            return None
+        sample_rate, block_size, envelope = cached
+        return len(envelope) * block_size / sample_rate
+
+    #
+    # The entries for a file are keyed by its content, so they are found if the file is moved
+    # and not once it is changed
+    #
+    def _cache_key(self, media_file, name):
+        return os.path.join(self.fingerprints.fingerprint(media_file), name)
+
+    def _publish_failure(self, file_name, error):
+        if self.progress_callback is not None:
+            self.progress_callback(0.0)
+        if self.failed_callback is not None:
+            self.failed_callback(file_name, str(error))
 
+    def _publish_segments(self, segments):
+        if self.progress_callback is not None:
+            self.progress_callback(0.0)
+        if self.completed_callback is not None:
+            self.completed_callback(segments)
+
+    #
+    # The segments of a file for the profile from memory or else the segment store, which are
+    # then kept in memory, or None if they aren't cached
+    #
+    def _cached_segments(self, file_name, profile):
+        key = self._cache_key(file_name, profile.name)
+        segments = self.memory_cache.get(("segments", key, self.refine_boundaries))
+        if segments is None:
+            segments = self.segment_store.get(key, profile, self.refine_boundaries)
+            if segments is not None:
+                self.memory_cache.put(("segments", key, self.refine_boundaries), segments)
+        return segments
+
+    def _store_segments(self, file_name, profile, segments):
+        key = self._cache_key(file_name, profile.name)
+        self.segment_store.put(key, profile, self.refine_boundaries, segments)
+        self.memory_cache.put(("segments", key, self.refine_boundaries), list(segments))
+
+    #
+    # The sample rate, block size and envelope of a file from memory or else the envelope cache,
+    # or None if it isn't cached.  The envelope read from the file is copied so that the cache
+    # file isn't held open by the memory map.  Another process may evict the file at any time.
+    #
+    def _cached_envelope(self, file_name):
+        env_file = self._cache_key(file_name, SegmentsAnalyzer.ENVELOPE_KEY)
+        cached = self.memory_cache.get(("envelope", env_file))
+        if cached is not None:
+            return cached
+        try:
+            if not self.envelope_cache.is_file_in_cache(env_file):
+                return None
+            cached = EnvelopeFile.load(self.envelope_cache.get_file_cache_name(env_file))
+            if cached is None:
+                return None
+            sample_rate, block_size, envelope = cached
+            cached = (sample_rate, block_size, np.array(envelope))
+        except OSError:
+            return None
+        self.memory_cache.put(("envelope", env_file), cached)
+        return cached
+
+    def _segments_from_cached_envelope(self, file_name, profile):
+        cached = self._cached_envelope(file_name)
+        if cached is None:
+            return None
+        sample_rate, block_size, envelope = cached
+        detector = SegmentDetector(profile, sample_rate, block_size, self.refine_boundaries)
+        detector.feed(envelope)
+        return detector.finish()
+
+    #
+    # The number of samples in each value of the cached envelope
+    #
     @staticmethod
-    def _windows(signal, window_size, step_size):
-        if type(window_size) is not int:
-            raise AttributeError("Window size must be an integer.")
-        if type(step_size) is not int:
-            raise AttributeError("Step size must be an integer.")
-        for i_start in range(0, len(signal), step_size):
-            i_end = i_start + window_size
-            if i_end >= len(signal):
-                break
-            yield signal[i_start:i_end]
+    def _envelope_block_size(sample_rate):
+        return max(1, int(round(SegmentsAnalyzer.ENVELOPE_BLOCK_DURATION * sample_rate)))
 
     @staticmethod
     def _energy(samples):
         return np.sum(np.power(samples, 2.)) / float(len(samples))
 
+    #
+    # The start of each segment is where the energy rises above the silence threshold,
+    # with a final frame added for the end of the file
+    #
+    @staticmethod
+    def _segments_from_energy(window_energy, silence_threshold, step_duration):
+        window_sound = np.asarray(window_energy) > silence_threshold
+        rising, _previous_sound = SegmentsAnalyzer._rising_edges_from(window_sound)
+        frames = [int(r) * step_duration for r in rising]
+        frames.append(len(window_sound) * step_duration)
+        return frames
+
+    #
+    # The indexes of the rising edges of a block of a binary signal, given the value before the
+    # start of the block.  Also returns the last value, for the next block.
+    #
+    @staticmethod
+    def _rising_edges_from(binary_signal, previous_value=False):
+        if len(binary_signal) == 0:
+            return np.zeros(0, dtype=np.int64), previous_value
+        rising = np.flatnonzero(binary_signal & ~np.concatenate(([previous_value], binary_signal[:-1])))
+        return rising, bool(binary_signal[-1])
+
+    #
+    # Only the foreground file is reported to the callbacks, the others just fill the caches.
+    # A failure is reported too, and then left to the scheduler to log.
+    #
+    def _run_job(self, job):
+        self._request.tag = job.tag
+        if job.priority != AnalysisJob.FOREGROUND and self.segments_cached(job.file_name, job.profile):
+            return
+        try:
+            self._compute_segments(job.file_name, job.profile, job.cancelled,
+                                   publish=job.priority == AnalysisJob.FOREGROUND)
+        except Exception as e:
+            if job.priority == AnalysisJob.FOREGROUND:
+                self._publish_failure(job.file_name, e)
+            raise
+
+    #
+    # Decode an MP3 straight into blocks of 16 bit samples with mpg123.  Returns the sample rate,
+    # the maximum energy of a sample, the (estimated) number of samples and a function giving
+    # the blocks from a sample on, or None if mpg123 can't decode the file.
+    #
+    def _mp3_source(self, file_name):
+        #
+        # The cached envelope is used for all of the profiles so it needs the highest of their rates
+        #
+        min_sample_rate = 0
+        if self.reduced_decode:
+            min_sample_rate = max(p.min_sample_rate for p in self.analyzer_profiles.values())
+        mp3 = None
+        try:
+            mp3 = ExtMpg123()
+            sample_rate, channels, source_channels = mp3.open_for_analysis(file_name, min_sample_rate)
+            try:
+                sample_count = mp3.length()
+            except (mpg123.Mpg123.LengthException, mpg123.Mpg123.NeedMoreException):
+                sample_count = 0
+        except (mpg123.Mpg123.LibInitializationException, mpg123.Mpg123.OpenFileException,
+                mpg123.Mpg123.FormatException, mpg123.Mpg123.NeedMoreException):
+            return None
+        finally:
+            if mp3 is not None:
+                mp3.close()
+
+        #
+        # Decode with a handle of its own, which is closed once the blocks have been read or
+        # the reading is stopped.  Start a little before the first sample so that the decoder
+        # has settled by then.
+        #
+        def blocks(first_sample=0):
+            block_mp3 = ExtMpg123()
+            try:
+                block_mp3.open_for_analysis(file_name, min_sample_rate)
+                skip = min(first_sample, parallelenvelope.PREROLL_SAMPLES)
+                if first_sample > 0:
+                    block_mp3.seek(first_sample - skip)
+                for block in block_mp3.iter_blocks(parallelenvelope.DECODE_BLOCK_BYTES):
+                    samples = np.frombuffer(block, dtype=np.int16).reshape(-1, channels)
+                    if skip > 0:
+                        cut = min(skip, len(samples))
+                        samples = samples[cut:]
+                        skip -= cut
+                    yield samples
+            except (mpg123.Mpg123.OpenFileException, mpg123.Mpg123.LengthException):
+                return
+            finally:
+                block_mp3.close()
+
+        #
+        # The energy of a sample is summed over the channels, so scale a mono mix down so
+        # that the profile thresholds mean the same as for the original channels
+        #
+        max_energy = SegmentsAnalyzer._energy([np.iinfo(np.int16).max]) * channels / source_channels
+        return sample_rate, max_energy, sample_count, blocks, \
+            (parallelenvelope.mp3_chunk, (file_name, min_sample_rate))
+
+    #
+    # Estimate the segments from the layer III side information of the frames, without decoding
+    # the file.  The estimated loudness isn't calibrated, so the silence threshold is taken
+    # relative to the loud parts of the file.  Returns None if the file isn't a layer III MP3.
+    #
+    def _quick_segments(self, frames, profile):
+        frame_energy = frames.loudness()
+        if frame_energy is None or len(frame_energy) == 0:
+            return None
+
+        frame_duration = float(frames.frame_samples[0]) / frames.sample_rate
+        window_size = max(1, int(round(profile.window_duration / frame_duration)))
+        step_size = max(1, int(round(profile.step_duration / frame_duration)))
+        window_energy = EnergyEnvelope.aggregate(frame_energy, window_size, step_size)
+        if len(window_energy) == 0:
+            return None
+
+        silence_threshold = np.percentile(window_energy, 95) * \
+            profile.silence_threshold / SegmentsAnalyzer.QUICK_SPEECH_ENERGY
+        return SegmentsAnalyzer._segments_from_energy(window_energy, silence_threshold, step_size * frame_duration)
+
+    #
+    # Convert the file with pydub to 16 bit mono samples, at the same rate as an MP3 would be
+    # decoded, if there isn't already a copy in the cache, and return the samples in blocks
+    #
+    def _pcm_source(self, file_name, _abandon_processing, progress_callback=None):
+        pcm_key = self._cache_key(file_name, SegmentsAnalyzer.PCM_KEY)
+        cfn = self.pcm_cache.get_file_cache_name(pcm_key)
+        if not self.pcm_cache.is_file_in_cache(pcm_key):
+            if progress_callback is not None:
+                progress_callback(SegmentsAnalyzer.WAVE_CONVERT_PROGRESS)
+            audio = AudioSegment.from_file(file_name)
+            source_channels = audio.channels
+            audio = audio.set_sample_width(2).set_channels(1)
+            if self.reduced_decode:
+                min_sample_rate = max(p.min_sample_rate for p in self.analyzer_profiles.values())
+                audio = audio.set_frame_rate(
+                    audio.frame_rate >> ExtMpg123.down_sample_for(audio.frame_rate, min_sample_rate))
+            samples = np.frombuffer(audio.raw_data, dtype="<i2")
+            self.pcm_cache.reserve(PcmFile.estimated_size(samples, compress=self.compress_pcm))
+            with self.pcm_cache.writing(pcm_key) as temp_file:
+                PcmFile.save(temp_file, audio.frame_rate, samples, source_channels, self.compress_pcm)
+            if _abandon_processing.is_set():
+                return None
+
+        pcm = PcmFile(cfn)
+
+        #
+        # As for a mono mix of an MP3, scale the maximum energy for the channels mixed down
+        #
+        max_energy = SegmentsAnalyzer._energy([np.iinfo(np.int16).max]) / pcm.source_channels
+        return pcm.sample_rate, max_energy, pcm.sample_count, pcm.iter_blocks, (parallelenvelope.pcm_chunk, (cfn,))
+
     @staticmethod
-    def _rising_edges(binary_signal):
-        previous_value = 0
-        index = 0
-        for x in binary_signal:
-            if x and not previous_value:
-                yield index
-            previous_value = x
-            index += 1
-
-    def _process_queue(self, pqueue, _abandon_processing):
-        while True:
-            file_name = pqueue.get(block=True, timeout=None)
-            _abandon_processing.clear()
-            self._compute_segments(file_name, _abandon_processing)
+    def _serial_envelope(blocks, block_size, max_energy, samples_done=0):
+        base_envelope = EnergyEnvelope(block_size, block_size, max_energy)
+        for block in blocks:
+            samples_done += len(block)
+            yield base_envelope.feed(block), samples_done
+
+    #
+    # The workers are spawned rather than forked, as forking a process that is running Tk and
+    # the player threads isn't safe
+    #
+    def _process_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
 
     #
     # Take an audio file and look for windows of window_silence level of power of window_duration seconds,
     # and when a window is found, skip forward step_duration
     #
-    def _compute_segments(self, file_name, _abandon_processing):
+    def _compute_segments(self, file_name, profile, _abandon_processing, publish=True):
+        progress_callback = self.progress_callback if publish else None
+        segments_callback = self.segments_callback if publish else None
+        completed_callback = self.completed_callback if publish else None
+
+        #
+        # Scan the frames of an MP3 for the quick segments and to cache the frame index for the
+        # player, if it isn't already cached
+        #
+        quick = self.quick_analysis and completed_callback is not None
+        frames = None
+        if file_name.lower().endswith(".mp3") and (quick or not self.frame_indexes.contains(file_name)):
+            try:
+                frames = Mp3Frames(file_name)
+            except (OSError, ValueError):
+                pass
+            if frames is not None and not self.frame_indexes.contains(file_name):
+                self.frame_indexes.put_frames(file_name, frames)
+
         #
-        # Convert the file to WAV format if there isn't already a copy in the cache
+        # Give the user something to navigate with while the file is being decoded
         #
-        cfn = self.wave_cache.get_file_cache_name(file_name)
-        _work_wave_convert_time = 0
-        if not self.wave_cache.is_file_in_cache(file_name):
-            _work_wave_convert_time = 20.0
-            if self.progress_callback is not None:
-                self.progress_callback(_work_wave_convert_time)
-            AudioSegment.from_file(file_name).export(cfn, format="wav")
-            self.wave_cache.add_file(file_name)
+        if quick and frames is not None:
+            quick_segments = self._quick_segments(frames, profile)
             if _abandon_processing.is_set():
                 return
+            if quick_segments is not None:
+                completed_callback(quick_segments)
+
+        #
+        # Only one thread or process at a time analyses a file, the others wait for it and
+        # then use what it has cached
+        #
+        lock = self.envelope_cache.lock(self._cache_key(file_name, SegmentsAnalyzer.ANALYSIS_LOCK_KEY))
+        if not lock.acquire(_abandon_processing):
+            return
+        try:
+            segments = self._cached_segments(file_name, profile)
+            if segments is None:
+                segments = self._segments_from_cached_envelope(file_name, profile)
+                if segments is not None:
+                    self._store_segments(file_name, profile, segments)
+            if segments is not None:
+                if progress_callback is not None:
+                    progress_callback(0.0)
+                if completed_callback is not None:
+                    completed_callback(segments)
+                return
 
+            #
+            # Decode MP3 files directly, falling back to converting the file with pydub
+            #
+            progress_start = 0.0
+            source = self._mp3_source(file_name)
+            if source is None:
+                progress_start = SegmentsAnalyzer.WAVE_CONVERT_PROGRESS
+                source = self._pcm_source(file_name, _abandon_processing, progress_callback)
+                if source is None:
+                    return
+            sample_rate, max_energy, sample_count, blocks, (worker, worker_args) = source
+            block_size = SegmentsAnalyzer._envelope_block_size(sample_rate)
+
+            self._compute_envelope_segments(
+                file_name, profile, _abandon_processing, sample_rate, max_energy, sample_count, block_size,
+                blocks, worker, worker_args, progress_start,
+                progress_callback, segments_callback, completed_callback)
+        finally:
+            lock.release()
+
+    #
+    # The envelope saved when the analysis of the file was last stopped, if it is for the same
+    # sample rate and block size
+    #
+    def _load_checkpoint(self, file_name, sample_rate, block_size):
+        checkpoint_key = self._cache_key(file_name, SegmentsAnalyzer.CHECKPOINT_KEY)
+        if not self.envelope_cache.is_file_in_cache(checkpoint_key):
+            return np.zeros(0, dtype=np.float32)
+        try:
+            checkpoint = EnvelopeFile.load(self.envelope_cache.get_file_cache_name(checkpoint_key))
+        except OSError:
+            return np.zeros(0, dtype=np.float32)
+        if checkpoint is None or checkpoint[0] != sample_rate or checkpoint[1] != block_size:
+            return np.zeros(0, dtype=np.float32)
+        return checkpoint[2]
+
+    def _compute_envelope_segments(self, file_name, profile, _abandon_processing, sample_rate, max_energy,
+                                   sample_count, block_size, blocks, worker, worker_args, progress_start,
+                                   progress_callback, segments_callback, completed_callback):
+        #
+        # Carry on from the checkpoint if there is one, otherwise start a new one
         #
-        # Analyse the wave file
+        checkpoint_key = self._cache_key(file_name, SegmentsAnalyzer.CHECKPOINT_KEY)
+        checkpoint_file = self.envelope_cache.get_file_cache_name(checkpoint_key)
+        resumed = self._load_checkpoint(file_name, sample_rate, block_size)
+        if len(resumed) == 0:
+            self.envelope_cache.remove_file(checkpoint_key)
+        first_block = len(resumed)
+        first_sample = first_block * block_size
+
+        #
+        # Build the rest of the envelope at the base resolution, a block of samples at a time as
+        # they are decoded or, for a long file, a chunk at a time from the process pool
         #
-        sample_rate, samples = wavfile.read(filename=cfn, mmap=True)
-        max_amplitude = np.iinfo(samples.dtype).max
-        max_energy = SegmentsAnalyzer._energy([max_amplitude])
+        if self.workers > 1 and sample_count - first_sample > SegmentsAnalyzer.PARALLEL_MIN_DURATION * sample_rate:
+            pieces = parallelenvelope.iter_envelope(
+                self._process_pool(), worker, worker_args, sample_count, block_size, max_energy,
+                self.workers * SegmentsAnalyzer.PARALLEL_CHUNKS_PER_WORKER, _abandon_processing, first_block)
+        else:
+            pieces = SegmentsAnalyzer._serial_envelope(blocks(first_sample), block_size, max_energy, first_sample)
 
-        window_size = int(self.analyzer_profile.window_duration * sample_rate)
-        step_size = int(self.analyzer_profile.step_duration * sample_rate)
+        #
+        # The checkpoint is fed back in first, in pieces, without being written again
+        #
+        resumed_pieces = ((resumed[i:i + SegmentsAnalyzer.CHECKPOINT_FEED_BLOCKS],
+                           min(i + SegmentsAnalyzer.CHECKPOINT_FEED_BLOCKS, first_block) * block_size, False)
+                          for i in range(0, first_block, SegmentsAnalyzer.CHECKPOINT_FEED_BLOCKS))
+        new_pieces = ((energies, samples_done, True) for energies, samples_done in pieces)
 
-        signal_windows = SegmentsAnalyzer._windows(
-            signal=samples,
-            window_size=window_size,
-            step_size=step_size
-        )
+        #
+        # Find the segments of the profile from the envelope
+        #
+        detector = SegmentDetector(profile, sample_rate, block_size, self.refine_boundaries)
+        pct_complete = int(progress_start)
+        published = 0
+        published_to = 0.0
+        published_time = time.monotonic()
+        checkpoint = EnvelopeFile.open_append(checkpoint_file, sample_rate, block_size)
 
-        work_progress_units = 1 + (int(int(len(samples) / float(step_size)) / (100.0 - _work_wave_convert_time)))
-        pct_complete = _work_wave_convert_time
-        window_energy = []
-        for i, w in enumerate(signal_windows):
-            window_energy.append(SegmentsAnalyzer._energy(w) / max_energy)
+        #
+        # Stop, keeping the checkpoint to carry on from next time
+        #
+        def stop():
+            checkpoint.close()
+            if not self.envelope_cache.is_file_in_cache(checkpoint_key):
+                self.envelope_cache.add_file(checkpoint_key)
+
+        for energies, samples_done, new in itertools.chain(resumed_pieces, new_pieces):
+            if new:
+                EnvelopeFile.append(checkpoint, energies)
+            detector.feed(energies)
             #
             # Check if we should stop
             #
             if _abandon_processing.is_set():
+                stop()
                 return
             #
-            # Report progress
+            # Report progress, at most once per percent
+            #
+            if sample_count > 0:
+                pct = int(progress_start + (100.0 - progress_start) * min(1.0, samples_done / sample_count))
+                if pct > pct_complete:
+                    pct_complete = pct
+                    if progress_callback is not None:
+                        progress_callback(pct_complete)
             #
-            if (i % work_progress_units) == 0:
-                pct_complete += 1
-                if self.progress_callback is not None:
-                    self.progress_callback(pct_complete)
+            # Hand over the segments found so far in batches
+            #
+            if self.incremental and segments_callback is not None and \
+                    time.monotonic() - published_time >= SegmentsAnalyzer.SEGMENTS_BATCH_INTERVAL:
+                analysed_to = detector.analysed_to()
+                segments_callback(detector.segments[published:], published_to, analysed_to)
+                published = len(detector.segments)
+                published_to = analysed_to
+                published_time = time.monotonic()
+
+        if _abandon_processing.is_set():
+            stop()
+            return
 
-        window_silence = (e > self.analyzer_profile.silence_threshold for e in window_energy)
-        frames = []
-        for r in SegmentsAnalyzer._rising_edges(window_silence):
-            frames.append(r * self.analyzer_profile.step_duration)
+        frames = detector.finish()
+        if self.incremental and segments_callback is not None:
+            segments_callback(frames[published:], published_to, float("inf"))
 
-        # Add frame for the end of the file
-        frames.append(len(window_energy) * self.analyzer_profile.step_duration)
+        if progress_callback is not None:
+            progress_callback(0.0)
 
-        if self.progress_callback is not None:
-            self.progress_callback(0.0)
-
-        if self.completed_callback is not None:
-            self.completed_callback(frames)
+        if completed_callback is not None:
+            completed_callback(frames)
 
-        # store the frames in the cache
-        seg_file = os.path.join(file_name, self.analyzer_profile.name)
-        cache_seg_file = self.segments_cache.get_file_cache_name(seg_file)
-        pickle.dump(frames, open(cache_seg_file, "wb"))
-        self.segments_cache.add_file(seg_file)
+        #
+        # The checkpoint is now the whole envelope, store it and the frames in the cache
+        #
+        checkpoint.close()
+        env_file = self._cache_key(file_name, SegmentsAnalyzer.ENVELOPE_KEY)
+        os.replace(checkpoint_file, self.envelope_cache.get_file_cache_name(env_file))
+        self.envelope_cache.remove_file(checkpoint_key)
+        self.envelope_cache.add_file(env_file)
+        self._store_segments(file_name, profile, frames)
 
 
 if __name__ == "__main__":
-    import time
 
     def callback(f):
         print("Found {} frames".format(len(f)))
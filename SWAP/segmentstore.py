@@ -0,0 +1,118 @@
+"""
+Store the segments of all of the analysed files in one SQLite database rather than a pickle
+per file, so that there is a single file to open, a lookup is one indexed query and nothing
+but numbers is read back.
+
+Each entry holds the segment start times as packed little endian float32s, the version of
+the format and the parameters of the profile that found them.  An entry for other profile
+parameters or an older version isn't returned, so the file is analysed again.
+
+Like the media caches, the store is kept to a number of entries by dropping those that
+were least recently used.
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import numpy as np
+from appdirs import user_cache_dir
+
+
+class SegmentStore:
+    STORE_NAME = "segments.sqlite"
+    VERSION = 1
+    MAX_ENTRIES = 20000
+
+    #
+    # The cache directory of the segment pickles that the store replaces
+    #
+    OLD_PICKLES_GROUP = "seg"
+
+    def __init__(self, store_file=None, max_entries=MAX_ENTRIES):
+        #
+        # The pickles left by an older version are removed the first time the store is opened
+        #
+        if store_file is None:
+            store_file = os.path.join(user_cache_dir('SWAP', '48clyde'), SegmentStore.STORE_NAME)
+            if not os.path.exists(store_file):
+                shutil.rmtree(os.path.join(user_cache_dir('SWAP', '48clyde'), SegmentStore.OLD_PICKLES_GROUP),
+                              ignore_errors=True)
+        os.makedirs(os.path.dirname(store_file), exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._store = sqlite3.connect(store_file, timeout=10.0, check_same_thread=False)
+        self._store.execute("PRAGMA journal_mode=WAL")
+        self._store.execute("CREATE TABLE IF NOT EXISTS segments "
+                            "(key TEXT PRIMARY KEY, version INTEGER, parameters TEXT, boundaries BLOB, accessed REAL)")
+        columns = [row[1] for row in self._store.execute("PRAGMA table_info(segments)")]
+        if "accessed" not in columns:
+            self._store.execute("ALTER TABLE segments ADD COLUMN accessed REAL")
+            self._store.execute("UPDATE segments SET accessed = ?", (time.time(),))
+        self._store.execute("CREATE INDEX IF NOT EXISTS segments_accessed ON segments (accessed)")
+        self._store.commit()
+
+    #
+    # The parameters that the segments depend on, as stored with them
+    #
+    @staticmethod
+    def _parameters(profile, refine):
+        return "{!r},{!r},{!r},{:d}".format(
+            profile.window_duration, profile.silence_threshold, profile.step_duration, bool(refine))
+
+    def get(self, key, profile, refine):
+        with self._lock:
+            row = self._store.execute("SELECT version, parameters, boundaries FROM segments WHERE key = ?",
+                                      (key,)).fetchone()
+            if row is None or row[0] != SegmentStore.VERSION or row[1] != SegmentStore._parameters(profile, refine):
+                return None
+            with self._store:
+                self._store.execute("UPDATE segments SET accessed = ? WHERE key = ?", (time.time(), key))
+        return np.frombuffer(row[2], dtype="<f4").astype(np.float64).tolist()
+
+    def contains(self, key, profile, refine):
+        with self._lock:
+            row = self._store.execute("SELECT version, parameters FROM segments WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == SegmentStore.VERSION and \
+            row[1] == SegmentStore._parameters(profile, refine)
+
+    #
+    # Store the segments of a file, dropping the least recently used entries if the store is
+    # then over its number of entries
+    #
+    def put(self, key, profile, refine, segments):
+        boundaries = np.asarray(segments, dtype="<f4").tobytes()
+        with self._lock:
+            with self._store:
+                self._store.execute(
+                    "INSERT OR REPLACE INTO segments (key, version, parameters, boundaries, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, SegmentStore.VERSION, SegmentStore._parameters(profile, refine), boundaries, time.time()))
+                excess = self._store.execute("SELECT COUNT(*) FROM segments").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self._store.execute("DELETE FROM segments WHERE key IN "
+                                        "(SELECT key FROM segments ORDER BY accessed, rowid LIMIT ?)", (excess,))
+
+    def remove(self, key):
+        with self._lock:
+            with self._store:
+                self._store.execute("DELETE FROM segments WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._store.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+
+if __name__ == "__main__":
+    from SWAP.segmentsanalyzer import AnalyzerProfile
+
+    store = SegmentStore(os.path.join(user_cache_dir('SWAP', '48clyde'), "segments-test.sqlite"))
+    profile = AnalyzerProfile("standard", 0.4, 1e-6, 0.3)
+    t = time.perf_counter()
+    for i in range(2000):
+        store.put("track{}".format(i), profile, True, np.cumsum(np.random.rand(500) * 5.0))
+    print("Stored {} tracks in {:.2f}s".format(len(store), time.perf_counter() - t))
+    t = time.perf_counter()
+    segments = store.get("track1000", profile, True)
+    print("Looked up {} segments in {:.5f}s".format(len(segments), time.perf_counter() - t))
@@ -0,0 +1,21 @@
+from SWAP.analysisscheduler import AnalysisScheduler
+
+
+class Profile:
+    name = "standard"
+
+
+def test_worker_carries_on_after_a_failing_job():
+    def run(job):
+        if job.file_name == "bad.mp3":
+            raise ValueError("can't decode")
+
+    scheduler = AnalysisScheduler(run, workers=1)
+    bad = scheduler.submit("bad.mp3", Profile())
+    good = scheduler.submit("good.mp3", Profile())
+
+    assert bad.finished.wait(5)
+    assert good.finished.wait(5)
+    assert isinstance(bad.error, ValueError)
+    assert good.error is None
+    assert scheduler.running() == []
@@ -0,0 +1,30 @@
+import numpy as np
+from SWAP.energyenvelope import EnergyEnvelope
+
+
+#
+# The original one window at a time calculation that EnergyEnvelope replaces
+#
+def reference_window_energy(samples, window_size, step_size, max_energy):
+    energies = []
+    for start in range(0, len(samples), step_size):
+        end = start + window_size
+        if end >= len(samples):
+            break
+        energies.append(np.sum(np.power(samples[start:end], 2.)) / float(window_size) / max_energy)
+    return np.array(energies)
+
+
+def test_matches_reference_in_any_block_size():
+    rng = np.random.default_rng(1)
+    samples = rng.integers(-32768, 32767, size=50000).astype(np.int16)
+    expected = reference_window_energy(samples, 441, 331, 32767.0 ** 2)
+    for chunk_size in [1, 100, 7919, 1 << 20]:
+        envelope = EnergyEnvelope.compute(samples, 441, 331, 32767.0 ** 2, chunk_size=chunk_size)
+        assert len(envelope) == len(expected)
+        np.testing.assert_allclose(envelope, expected, rtol=1e-6)
+
+
+def test_windows_compared_in_float64():
+    energies = EnergyEnvelope.aggregate(np.full(100, 0.1, dtype=np.float32), 10, 5)
+    assert energies.dtype == np.float64
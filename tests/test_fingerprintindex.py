@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pytest
+from SWAP.fingerprintindex import FingerprintIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    return FingerprintIndex(str(tmp_path / "fingerprints.sqlite"))
+
+
+def write_file(file_name, size, seed=0):
+    data = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+    with open(file_name, "wb") as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("size", [1000, 5 << 20])
+def test_renamed_file_has_the_same_fingerprint(tmp_path, index, size):
+    original = str(tmp_path / "lesson 1.mp3")
+    write_file(original, size)
+    fingerprint = index.fingerprint(original)
+
+    renamed = str(tmp_path / "moved" / "Lesson 01.mp3")
+    os.makedirs(os.path.dirname(renamed))
+    os.rename(original, renamed)
+
+    assert index.fingerprint(renamed) == fingerprint
+
+
+@pytest.mark.parametrize("size", [1000, 5 << 20])
+def test_changed_file_has_a_new_fingerprint(tmp_path, index, size):
+    file_name = str(tmp_path / "lesson.mp3")
+    write_file(file_name, size)
+    fingerprint = index.fingerprint(file_name)
+
+    with open(file_name, "r+b") as f:
+        f.seek(size - 10)
+        f.write(b"changed!")
+    stat = os.stat(file_name)
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    assert index.fingerprint(file_name) != fingerprint
+    assert index.fingerprint(file_name) == FingerprintIndex.compute(file_name, size)
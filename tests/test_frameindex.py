@@ -0,0 +1,28 @@
+import os
+import shutil
+import numpy as np
+from SWAP.frameindex import FrameIndexCache
+from SWAP.fingerprintindex import FingerprintIndex
+from SWAP.segmentstore import SegmentStore
+
+SPEECH_MP3 = os.path.join(os.path.dirname(__file__), "data", "speech.mp3")
+
+
+def test_index_is_built_once_and_then_read_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    media_file = str(tmp_path / "speech.mp3")
+    shutil.copy(SPEECH_MP3, media_file)
+    indexes = FrameIndexCache(FingerprintIndex(str(tmp_path / "fingerprints.sqlite")))
+    assert indexes.get(media_file) is None
+
+    built = indexes.get_or_build(media_file)
+
+    assert indexes.contains(media_file)
+    cached = indexes.get(media_file)
+    assert np.array_equal(cached.offsets, built.offsets)
+    assert np.array_equal(cached.frame_samples, built.frame_samples)
+    assert abs(cached.duration() - 24.2) < 0.2
+
+
+def test_indexes_are_kept_for_as_many_files_as_the_segments():
+    assert FrameIndexCache.MAX_FILES == SegmentStore.MAX_ENTRIES
@@ -0,0 +1,100 @@
+import os
+from SWAP.mediacache import MediaCache
+
+
+def test_file_evicted_by_another_process_is_not_in_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    ours = MediaCache("test", 1 << 20, 10)
+    theirs = MediaCache("test", 1 << 20, 10)
+    with ours.writing("envelope") as temp_file:
+        with open(temp_file, "wb") as f:
+            f.write(b"x" * 100)
+    assert ours.is_file_in_cache("envelope")
+
+    theirs.remove_file("envelope")
+
+    assert not ours.is_file_in_cache("envelope")
+    assert ours.cached_size == 0
+    assert not os.path.exists(ours.get_file_cache_name("envelope"))
+
+
+def test_writes_from_another_process_are_picked_up(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    ours = MediaCache("test", 1 << 20, 10)
+    theirs = MediaCache("test", 1 << 20, 10)
+    for cache, name in [(theirs, "a"), (ours, "b")]:
+        with cache.writing(name) as temp_file:
+            with open(temp_file, "wb") as f:
+                f.write(b"x" * 10)
+
+    assert ours.get_file_cache_name("a") in ours.cached
+    assert ours.cached_size == 20
+
+
+def test_reserving_more_than_the_cache_holds_evicts_nothing(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = MediaCache("test", 100, 10)
+    for name in ["a", "b"]:
+        with cache.writing(name) as temp_file:
+            with open(temp_file, "wb") as f:
+                f.write(b"x" * 30)
+
+    assert not cache.reserve(1000)
+    assert cache.is_file_in_cache("a")
+    assert cache.is_file_in_cache("b")
+
+    assert cache.reserve(50)
+    assert not cache.is_file_in_cache("a")
+    assert cache.is_file_in_cache("b")
+
+
+def write(cache, name, size=10):
+    with cache.writing(name) as temp_file:
+        with open(temp_file, "wb") as f:
+            f.write(b"x" * size)
+
+
+def test_missing_manifest_is_rebuilt_from_the_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = MediaCache("test", 1 << 20, 10)
+    for i, name in enumerate(["a", "b", "c"]):
+        write(cache, name, 10 * (i + 1))
+    for f in os.listdir(cache.group_dir):
+        if f.startswith(MediaCache.MANIFEST_NAME):
+            os.remove(os.path.join(cache.group_dir, f))
+
+    rebuilt = MediaCache("test", 1 << 20, 10)
+    reopened = MediaCache("test", 1 << 20, 10)
+
+    assert set(rebuilt.cached) == set(cache.cached)
+    assert rebuilt.cached_size == 60
+    assert list(reopened.cached) == list(rebuilt.cached)
+    assert reopened.cached_size == 60
+
+
+def test_least_recently_used_order_is_kept_in_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = MediaCache("test", 1 << 20, 10)
+    for name in ["a", "b", "c"]:
+        write(cache, name)
+    assert cache.is_file_in_cache("a")
+    write(cache, "d")
+
+    reopened = MediaCache("test", 1 << 20, 10)
+
+    assert list(reopened.cached) == [cache.get_file_cache_name(name) for name in ["b", "c", "a", "d"]]
+
+
+def test_hits_are_written_to_the_manifest_together(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(MediaCache, "ACCESS_FLUSH_COUNT", 2)
+    cache = MediaCache("test", 1 << 20, 10)
+    for name in ["a", "b", "c"]:
+        write(cache, name)
+
+    assert cache.is_file_in_cache("a")
+    assert list(MediaCache("test", 1 << 20, 10).cached)[0] == cache.get_file_cache_name("a")
+
+    assert cache.is_file_in_cache("b")
+    assert list(MediaCache("test", 1 << 20, 10).cached) == \
+        [cache.get_file_cache_name(name) for name in ["c", "a", "b"]]
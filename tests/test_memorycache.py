@@ -0,0 +1,47 @@
+import numpy as np
+from SWAP.memorycache import MemoryCache
+
+
+def block(kb):
+    return np.zeros(kb * 1024, dtype=np.uint8)
+
+
+def test_least_recently_used_are_evicted_by_bytes():
+    cache = MemoryCache(100 * 1024)
+    cache.put("a", block(40))
+    cache.put("b", block(40))
+    assert cache.get("a") is not None
+
+    cache.put("c", block(40))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.bytes == 80 * 1024
+
+
+def test_one_large_value_evicts_several_small_ones():
+    cache = MemoryCache(100 * 1024)
+    for key in range(10):
+        cache.put(key, block(10))
+    cache.put("large", block(75))
+
+    assert [key for key in range(10) if cache.get(key) is not None] == [8, 9]
+    assert cache.bytes == 95 * 1024
+
+
+def test_value_bigger_than_the_cache_is_not_kept():
+    cache = MemoryCache(100 * 1024)
+    cache.put("a", block(40))
+    cache.put("a", block(200))
+
+    assert cache.get("a") is None
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_hits_and_misses_are_counted():
+    cache = MemoryCache(1024)
+    cache.put("a", [1.5, 2.5])
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+from SWAP.mp3frames import Mp3Frames
+from SWAP.segmentsanalyzer import SegmentsAnalyzer, AnalyzerProfile
+
+#
+# 24 seconds of 22050 Hz mono at 32 kbps: 16 tone bursts, each followed by a silent gap
+#
+SPEECH_MP3 = os.path.join(os.path.dirname(__file__), "data", "speech.mp3")
+GAPS = [(0.98, 1.6), (2.77, 3.38), (4.58, 5.11), (5.97, 6.4), (7.08, 7.51), (8.11, 8.77), (9.72, 10.27),
+        (11.38, 12.01), (12.76, 13.31), (14.23, 14.81), (15.84, 16.51), (17.23, 17.75), (18.48, 19.03),
+        (20.17, 20.87), (22.06, 22.57), (23.62, 24.17)]
+
+#
+# A valid MPEG 2 layer III header that isn't followed by another frame
+#
+FALSE_SYNC = b"\xff\xf3\x40\xc4"
+
+
+def frames_of(tmp_path, data):
+    file_name = str(tmp_path / "test.mp3")
+    with open(file_name, "wb") as f:
+        f.write(data)
+    return Mp3Frames(file_name)
+
+
+def in_gap(tsec, slack=0.1):
+    return any(start - slack <= tsec <= end + slack for start, end in GAPS)
+
+
+def test_header_walk():
+    frames = Mp3Frames(SPEECH_MP3)
+
+    assert (frames.sample_rate, frames.channels, frames.layer) == (22050, 1, 3)
+    assert np.all(frames.frame_samples == 576)
+    assert set(np.diff(frames.offsets)) == {104, 105}
+    assert abs(frames.sample_count() - 24.166 * 22050) < 4 * 576
+    assert frames.offsets[-1] + 105 >= os.path.getsize(SPEECH_MP3)
+
+
+def test_resync_after_junk_skips_false_sync_words(tmp_path):
+    with open(SPEECH_MP3, "rb") as f:
+        data = f.read()
+    original = Mp3Frames(SPEECH_MP3)
+    cut = int(original.offsets[100])
+    junk = b"\x00" * 7 + FALSE_SYNC + b"\x11" * 20 + b"\xff\xff\x00"
+
+    frames = frames_of(tmp_path, b"ID3\x03\x00\x00\x00\x00\x00\x05" + b"\x00" * 5 +
+                       junk + data[:cut] + junk + data[cut:])
+
+    assert len(frames) == len(original)
+    shift = 15 + len(junk)
+    assert np.array_equal(frames.offsets[:100], original.offsets[:100] + shift)
+    assert np.array_equal(frames.offsets[100:], original.offsets[100:] + shift + len(junk))
+
+
+def test_side_info_is_quieter_in_the_gaps():
+    frames = Mp3Frames(SPEECH_MP3)
+    loudness = frames.loudness()
+    times = (np.concatenate(([0], np.cumsum(frames.frame_samples)[:-1])) + 576) / frames.sample_rate
+    gap = np.array([any(start + 0.1 <= t <= end - 0.1 for start, end in GAPS) for t in times])
+    sound = np.array([not in_gap(t) for t in times])
+
+    assert frames.granule_blocks[0] == 1
+    assert np.all(frames.part2_3_length[:, 1:] == 0)
+    assert np.median(loudness[gap]) < 0.1 * np.median(loudness[sound])
+
+
+def test_quick_segments_start_in_the_gaps():
+    analyzer = SegmentsAnalyzer.__new__(SegmentsAnalyzer)
+    analyzer.refine_boundaries = True
+    segments = analyzer._quick_segments(Mp3Frames(SPEECH_MP3), AnalyzerProfile("standard", 0.4, 1e-6, 0.3))
+
+    assert segments[0] == 0.0
+    assert len(segments) >= 14
+    assert all(in_gap(s) for s in segments[1:])
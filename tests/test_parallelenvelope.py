@@ -0,0 +1,65 @@
+import concurrent.futures
+import os
+import threading
+import numpy as np
+import pytest
+from SWAP import parallelenvelope
+from SWAP.energyenvelope import EnergyEnvelope
+from SWAP.pcmfile import PcmFile
+from SWAP.player import ExtMpg123
+
+BLOCK_SIZE = 220
+MAX_ENERGY = 32767.0 ** 2
+SPEECH_MP3 = os.path.join(os.path.dirname(__file__), "data", "speech.mp3")
+
+
+def speech_like(seconds, rate=22050, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    loudness = np.clip(np.sin(2 * np.pi * 0.3 * t), 0, None)
+    signal = 8000 * loudness * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 200, len(t))
+    return signal.astype(np.int16)
+
+
+def stitched(worker, source_args, sample_count, chunks, first_block=0):
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        pieces = parallelenvelope.iter_envelope(pool, worker, source_args, sample_count, BLOCK_SIZE, MAX_ENERGY,
+                                                chunks, threading.Event(), first_block)
+        return np.concatenate([energies for energies, _samples_done in pieces])
+
+
+@pytest.mark.parametrize("chunks", [1, 3, 7, 50])
+@pytest.mark.parametrize("first_block", [0, 1, 1234])
+def test_pcm_chunks_match_the_serial_envelope_exactly(tmp_path, chunks, first_block):
+    samples = speech_like(30)
+    pcm_file = str(tmp_path / "pcm")
+    PcmFile.save(pcm_file, 22050, samples, block_samples=10000)
+    serial = EnergyEnvelope(BLOCK_SIZE, BLOCK_SIZE, MAX_ENERGY).feed(samples.reshape(-1, 1))
+
+    parallel = stitched(parallelenvelope.pcm_chunk, (pcm_file,), len(samples), chunks, first_block)
+
+    assert np.array_equal(parallel, serial[first_block:])
+
+
+#
+# Decoding an MP3 from a seek isn't guaranteed to give the same samples as decoding it from
+# the start, so the MP3 chunks are only expected to be within 0.1% of the loudest block
+#
+@pytest.mark.parametrize("chunks", [3, 7])
+def test_mp3_chunks_are_close_to_the_serial_envelope(chunks):
+    try:
+        mp3 = ExtMpg123()
+    except OSError:
+        pytest.skip("libmpg123 isn't installed")
+    try:
+        _rate, channels, _file_channels = mp3.open_for_analysis(SPEECH_MP3, 0)
+        samples = np.concatenate([np.frombuffer(b, dtype=np.int16).reshape(-1, channels)
+                                  for b in mp3.iter_blocks(parallelenvelope.DECODE_BLOCK_BYTES)])
+    finally:
+        mp3.close()
+    serial = EnergyEnvelope(BLOCK_SIZE, BLOCK_SIZE, MAX_ENERGY).feed(samples)
+
+    parallel = stitched(parallelenvelope.mp3_chunk, (SPEECH_MP3, 0), len(samples), chunks)
+
+    assert len(parallel) == len(serial)
+    assert np.max(np.abs(parallel - serial)) <= 1e-3 * np.max(serial)
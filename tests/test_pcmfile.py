@@ -0,0 +1,27 @@
+import os
+import numpy as np
+from SWAP.pcmfile import PcmFile
+
+
+def speech_like(seconds, rate=22050, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    loudness = np.clip(np.sin(2 * np.pi * 0.3 * t), 0, None)
+    signal = 8000 * loudness * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 200, len(t))
+    return signal.astype(np.int16)
+
+
+def test_estimated_size_of_an_uncompressed_file_is_exact(tmp_path):
+    samples = speech_like(20)
+    file_name = str(tmp_path / "pcm")
+    PcmFile.save(file_name, 22050, samples, compress=False)
+    assert PcmFile.estimated_size(samples, compress=False) == os.path.getsize(file_name)
+
+
+def test_estimated_size_is_close_to_the_compressed_size(tmp_path):
+    samples = speech_like(60)
+    file_name = str(tmp_path / "pcm")
+    PcmFile.save(file_name, 22050, samples)
+    size = os.path.getsize(file_name)
+    assert abs(PcmFile.estimated_size(samples) - size) < 0.25 * size
+    assert PcmFile.estimated_size(samples) < samples.nbytes
@@ -0,0 +1,160 @@
+import ctypes
+import queue
+import time
+import numpy as np
+from SWAP.pcmring import PcmRing
+from SWAP.player import Player, PlaybackTimer, TrackTiming
+
+RATE = 8000
+
+
+#
+# A mono 16 bit decoder whose samples are all 1000 times its volume
+#
+class FakeDecoder:
+    def __init__(self):
+        self.volume = 1.0
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def get_format(self):
+        return RATE, 1, 0
+
+    def encoding_size(self, _encoding):
+        return 2
+
+    def seek(self, _sample):
+        pass
+
+    def read_into(self, buffer, size):
+        samples = np.full(size // 2, int(round(1000 * self.volume)), dtype="<i2")
+        ctypes.memmove(buffer, samples.tobytes(), samples.nbytes)
+        return samples.nbytes
+
+
+def open_decoder(_file_name, _frame_index):
+    return FakeDecoder()
+
+
+#
+# Keeps the samples played, and can call back after a number of buffers
+#
+class FakeOut:
+    def __init__(self, after_buffers=None, callback=None):
+        self.played = bytearray()
+        self.buffers = 0
+        self.after_buffers = after_buffers
+        self.callback = callback
+
+    def start(self, rate, channels, encoding):
+        pass
+
+    def play_buffer(self, address, size):
+        self.played += ctypes.string_at(address, size)
+        self.buffers += 1
+        if self.buffers == self.after_buffers:
+            self.callback()
+
+
+class FakeMp3:
+    def set_volume(self, volume):
+        pass
+
+    def seek_frame(self, frame):
+        pass
+
+
+def loaded_ring():
+    ring = PcmRing(1 << 20, open_decoder)
+    ring.load("track.mp3", None, 10.0)
+    return ring
+
+
+#
+# A player that plays from the ring into a FakeOut, without a decoder or an audio device
+#
+def player_for(ring, out):
+    player = Player.__new__(Player)
+    player.mp3 = FakeMp3()
+    player.out = out
+    player.command_queue = queue.Queue(maxsize=1)
+    player.event_queue = queue.Queue()
+    player.timer = PlaybackTimer()
+    player.timing = TrackTiming(RATE, 1152, 100)
+    player.update_per_frame_count = 1
+    player.frame_index = None
+    player.pcm_ring = ring
+    player._output_format = None
+    player._silence = ctypes.create_string_buffer(Player.PCM_BUFFER_BYTES)
+    return player
+
+
+def test_decode_uses_the_volume():
+    ring = loaded_ring()
+    ring.set_volume(0)
+    segment = ring.decode(1.0, 2.0)
+
+    assert segment.volume == 0
+    assert segment.size == RATE * 2
+    assert not any(ctypes.string_at(segment.address(), segment.size))
+
+
+def test_changing_the_volume_empties_the_ring():
+    ring = loaded_ring()
+    ring.decode(1.0, 2.0)
+    assert ring.get(1.0, 2.0) is not None
+
+    ring.set_volume(0.5)
+
+    assert ring.get(1.0, 2.0) is None
+    assert ring.decode(1.0, 2.0).volume == 0.5
+
+
+def test_loop_at_volume_zero_is_silent():
+    ring = loaded_ring()
+    out = FakeOut()
+    player = player_for(ring, out)
+    player.set_volume(0)
+
+    player._play_pcm(ring.decode(1.0, 1.5), 1.5, repetitions=3)
+
+    assert len(out.played) == 3 * RATE
+    assert not any(out.played)
+
+
+def test_muting_while_looping_silences_the_rest():
+    ring = loaded_ring()
+    out = FakeOut()
+    player = player_for(ring, out)
+    out.after_buffers = 1
+    out.callback = lambda: player.set_volume(0)
+
+    player._play_pcm(ring.decode(1.0, 1.5), 1.5, repetitions=2)
+
+    played = np.frombuffer(bytes(out.played), dtype="<i2")
+    before_mute = Player.PCM_BUFFER_BYTES // 2
+    assert len(played) == 2 * RATE // 2
+    assert np.all(played[:before_mute] == 1000)
+    assert np.all(played[before_mute:] == 0)
+
+
+def test_segments_set_before_the_file_is_loaded_are_decoded():
+    ring = PcmRing(1 << 20, open_decoder)
+    ring.set_segments([0.0, 1.0, 2.0, 3.0], "track.mp3")
+    ring.load("track.mp3", None, 4.0)
+
+    deadline = time.monotonic() + 5.0
+    while len(ring) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ring.get(0.0, 1.0) is not None
+    assert ring.get(1.0, 2.0) is not None
+
+
+def test_segments_of_another_file_are_dropped_on_load():
+    ring = PcmRing(1 << 20, open_decoder)
+    ring.set_segments([0.0, 1.0, 2.0], "previous.mp3")
+    ring.load("track.mp3", None, 4.0)
+
+    time.sleep(0.1)
+    assert len(ring) == 0
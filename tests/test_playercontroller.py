@@ -0,0 +1,35 @@
+import os
+from SWAP.playercontroller import PlayerController
+from SWAP.playermodel import PlayerModel
+
+
+def controller():
+    c = PlayerController.__new__(PlayerController)
+    c.model = PlayerModel()
+    return c
+
+
+def test_natural_order():
+    names = ["track10.mp3", "Track2.mp3", "track1.mp3", "track2b.mp3", "track2a.mp3", "intro.mp3"]
+    assert sorted(names, key=PlayerController._natural_key) == \
+        ["intro.mp3", "track1.mp3", "Track2.mp3", "track2a.mp3", "track2b.mp3", "track10.mp3"]
+    assert PlayerController._natural_key("track2") < PlayerController._natural_key("track10")
+
+
+def test_next_files_follow_in_natural_order(tmp_path):
+    for name in ["lesson 1.mp3", "lesson 2.mp3", "lesson 10.mp3", "lesson 11.MP3", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+
+    following = controller().next_files(str(tmp_path / "lesson 2.mp3"), 2)
+
+    assert following == [os.path.join(str(tmp_path), "lesson 10.mp3"), os.path.join(str(tmp_path), "lesson 11.MP3")]
+
+
+def test_last_file_falls_back_to_the_recent_files(tmp_path):
+    for name in ["lesson 1.mp3", "lesson 2.mp3"]:
+        (tmp_path / name).write_bytes(b"")
+    c = controller()
+    recent = str(tmp_path / "lesson 1.mp3")
+    c.model.recent_files.set([str(tmp_path / "lesson 2.mp3"), recent, str(tmp_path / "gone.mp3")])
+
+    assert c.next_files(str(tmp_path / "lesson 2.mp3"), 3) == [recent]
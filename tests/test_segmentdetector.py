@@ -0,0 +1,42 @@
+import numpy as np
+from SWAP.segmentsanalyzer import AnalyzerProfile, SegmentDetector
+from SWAP.playermodel import PlayerModel
+
+
+#
+# An envelope of 10ms blocks of bursts of speech separated by pauses of random lengths
+#
+def speech_envelope(seconds, seed):
+    rng = np.random.default_rng(seed)
+    envelope = np.full(int(seconds * 100), 1e-9, dtype=np.float32)
+    position = 0
+    while position < len(envelope):
+        speech = int(rng.uniform(0.5, 4.0) * 100)
+        envelope[position:position + speech] = rng.uniform(1e-5, 1e-3, size=len(envelope[position:position + speech]))
+        position += speech + int(rng.uniform(0.2, 1.5) * 100)
+    return envelope
+
+
+def test_batches_splice_into_the_final_segments():
+    profile = AnalyzerProfile("standard", 0.4, 1e-6, 0.3)
+    for seed in range(20):
+        envelope = speech_envelope(300, seed)
+        rng = np.random.default_rng(seed)
+        detector = SegmentDetector(profile, 44100, 441, refine=True)
+        model = PlayerModel()
+        published = 0
+        published_to = 0.0
+        position = 0
+        while position < len(envelope):
+            size = int(rng.integers(1, 400))
+            detector.feed(envelope[position:position + size])
+            position += size
+            analysed_to = detector.analysed_to()
+            assert all(s < analysed_to for s in detector.segments[published:])
+            model.add_segments(detector.segments[published:], published_to, analysed_to)
+            published = len(detector.segments)
+            published_to = analysed_to
+
+        segments = detector.finish()
+        model.add_segments(segments[published:], published_to, float("inf"))
+        assert model.segments.get() == segments
@@ -0,0 +1,100 @@
+import threading
+import numpy as np
+from SWAP import segmentsanalyzer
+from SWAP.segmentsanalyzer import SegmentsAnalyzer
+
+RATE = 22050
+BLOCK_SAMPLES = 4410
+
+
+def speech_like(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    loudness = (np.sin(2 * np.pi * 0.4 * t + rng.uniform(0, 1)) > -0.2) * rng.uniform(0.5, 1.0)
+    signal = 8000 * loudness * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 20, len(t))
+    return signal.astype(np.int16).reshape(-1, 1)
+
+
+#
+# An analyzer with caches of its own in cache_dir
+#
+def analyzer_in(cache_dir, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_dir))
+    analyzer = SegmentsAnalyzer(analysis_workers=1)
+    analyzer.workers = 1
+    return analyzer
+
+
+#
+# Analyse the samples as if decoded from the file, setting abandon once stop_after blocks have
+# been read.  Returns the segments given to the completed callback.
+#
+def analyse(analyzer, media_file, samples, abandon, stop_after=None):
+    def blocks(first_sample=0):
+        for i, start in enumerate(range(first_sample, len(samples), BLOCK_SAMPLES)):
+            if stop_after is not None and i == stop_after:
+                abandon.set()
+            yield samples[start:start + BLOCK_SAMPLES]
+
+    completed = []
+    block_size = SegmentsAnalyzer._envelope_block_size(RATE)
+    analyzer._compute_envelope_segments(
+            media_file, analyzer.analyzer_profile, abandon, RATE, 32767.0 ** 2, len(samples), block_size,
+            blocks, None, None, 0.0, None, None, completed.append)
+    return completed
+
+
+def test_resuming_from_a_torn_checkpoint_gives_the_same_result(tmp_path, monkeypatch):
+    samples = speech_like(60)
+    media_file = tmp_path / "talk.wav"
+    media_file.write_bytes(samples.tobytes())
+
+    analyzer = analyzer_in(tmp_path / "uninterrupted", monkeypatch)
+    expected = analyse(analyzer, str(media_file), samples, threading.Event())
+    expected_envelope = analyzer._cached_envelope(str(media_file))[2]
+
+    analyzer = analyzer_in(tmp_path / "interrupted", monkeypatch)
+    assert analyse(analyzer, str(media_file), samples, threading.Event(), stop_after=120) == []
+    checkpoint_key = analyzer._cache_key(str(media_file), SegmentsAnalyzer.CHECKPOINT_KEY)
+    checkpoint_file = analyzer.envelope_cache.get_file_cache_name(checkpoint_key)
+    checkpoint_blocks = len(analyzer._load_checkpoint(str(media_file), RATE,
+                                                      SegmentsAnalyzer._envelope_block_size(RATE)))
+    assert 0 < checkpoint_blocks < len(expected_envelope)
+    with open(checkpoint_file, "ab") as f:
+        f.write(b"\x00\x7f")
+
+    resumed = analyse(analyzer, str(media_file), samples, threading.Event())
+
+    assert len(expected) == 1 and len(expected[0]) > 5
+    assert resumed == expected
+    assert np.array_equal(analyzer._cached_envelope(str(media_file))[2], expected_envelope)
+
+
+def test_a_failed_analysis_is_reported(tmp_path, monkeypatch):
+    media_file = tmp_path / "talk.wav"
+    media_file.write_bytes(speech_like(1).tobytes())
+    analyzer = analyzer_in(tmp_path / "cache", monkeypatch)
+    progress = []
+    failed = []
+    reported = threading.Event()
+    analyzer.progress_callback = progress.append
+    analyzer.failed_callback = lambda file_name, message: (failed.append((file_name, message)), reported.set())
+
+    def fail(*_args, **_kwargs):
+        raise ValueError("can't decode")
+    monkeypatch.setattr(analyzer, "_compute_segments", fail)
+    analyzer.process(str(media_file))
+
+    assert reported.wait(5)
+    assert failed == [(str(media_file), "can't decode")]
+    assert progress[-1] == 0.0
+
+
+def test_out_of_process_analyzer_leaves_the_caches_to_the_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(segmentsanalyzer, "AnalyzerProcess", lambda analyzer: object())
+
+    analyzer = SegmentsAnalyzer(out_of_process=True)
+
+    assert analyzer.segment_store is None and analyzer.envelope_cache is None
+    assert not (tmp_path / "SWAP").exists()
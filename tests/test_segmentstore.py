@@ -0,0 +1,47 @@
+import sqlite3
+from SWAP.segmentstore import SegmentStore
+
+
+class Profile:
+    window_duration = 0.4
+    silence_threshold = 1e-6
+    step_duration = 0.3
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments.sqlite"), max_entries=3)
+    for key in ["a", "b", "c"]:
+        store.put(key, Profile(), True, [0.0, 1.5, 3.0])
+    assert store.get("a", Profile(), True) == [0.0, 1.5, 3.0]
+
+    store.put("d", Profile(), True, [0.0, 2.0])
+
+    assert len(store) == 3
+    assert not store.contains("b", Profile(), True)
+    assert all(store.contains(key, Profile(), True) for key in ["a", "c", "d"])
+
+
+def test_store_without_access_times_is_migrated(tmp_path):
+    store_file = str(tmp_path / "segments.sqlite")
+    old = sqlite3.connect(store_file)
+    old.execute("CREATE TABLE segments (key TEXT PRIMARY KEY, version INTEGER, parameters TEXT, boundaries BLOB)")
+    old.commit()
+    old.close()
+
+    store = SegmentStore(store_file)
+    store.put("a", Profile(), True, [0.0, 1.0])
+    assert store.get("a", Profile(), True) == [0.0, 1.0]
+
+
+def test_old_pickles_are_removed_only_when_the_store_is_created(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    pickles = tmp_path / "SWAP" / SegmentStore.OLD_PICKLES_GROUP
+    pickles.mkdir(parents=True)
+    (pickles / "track.pkl").write_bytes(b"old")
+
+    SegmentStore()
+    assert not pickles.exists()
+
+    pickles.mkdir()
+    SegmentStore()
+    assert pickles.exists()
@@ -0,0 +1,36 @@
+import os
+import numpy as np
+from SWAP.frameindex import FrameIndex
+from SWAP.mp3frames import Mp3Frames
+from SWAP.player import TrackTiming
+
+SPEECH_MP3 = os.path.join(os.path.dirname(__file__), "data", "speech.mp3")
+
+
+def test_length_and_frame_times():
+    timing = TrackTiming(44100, 1152, 1000)
+
+    assert timing.length == 1000 * 1152 / 44100
+    assert timing.frame_seconds(0) == 0.0
+    assert timing.frame_seconds(441) == 441 * 1152 / 44100
+
+
+def test_nearest_sample_is_in_the_frame_returned_for_the_time():
+    timing = TrackTiming(22050, 576, 1000)
+    for tsec in np.linspace(0, timing.length, 997, endpoint=False):
+        frame = timing.timeframe(tsec)
+        sample = round(tsec * timing.rate)
+        assert frame * timing.samples_per_frame <= sample < (frame + 1) * timing.samples_per_frame
+
+
+def test_frame_start_times_map_back_to_their_frame():
+    timing = TrackTiming(48000, 1152, 1000)
+    assert all(timing.timeframe(timing.frame_seconds(frame)) == frame for frame in range(1000))
+
+
+def test_timing_from_a_frame_index():
+    frames = Mp3Frames(SPEECH_MP3)
+    timing = TrackTiming.from_index(FrameIndex.from_frames(frames))
+
+    assert (timing.rate, timing.samples_per_frame, timing.frames) == (22050, 576, len(frames))
+    assert timing.length == frames.sample_count() / 22050